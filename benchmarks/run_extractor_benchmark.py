@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+    Program to benchmark the text extractors of utils/xml2txt.py,
+    utils/html2txt.py and utils/doc2txt.py on the fixture corpus
+    in benchmarks/fixtures/ and to check their outputs
+    against the golden outputs in benchmarks/golden/<extractor>/.
+
+    For each extractor, the program reports the number of documents
+    processed per second, the number of MB of input processed per second,
+    the peak memory allocated by Python (tracemalloc, in a separate pass from the timed runs)
+    and the maximum resident set size of the process running the extractor,
+    as well as the number of outputs that differ from the golden outputs.
+
+    The golden output of a fixture is a <fixture>.txt file with the expected text,
+    or a <fixture>.error file with the name of the expected exception
+    (e.g., a UnicodeDecodeError for extractors that only read UTF-8).
+
+    Usage (from the repository root):
+    python benchmarks/run_extractor_benchmark.py [--repeat N] [--update-golden]
+
+    Use --update-golden to (re)write the golden outputs
+    after an intended change of the extracted text.
+    The program exits with status 1 if an output differs from its golden output.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.doc2txt import doc2txt_path_eu
+from utils.html2txt import html2txt_str, html2txt_str_eu
+from utils.xml2txt import xml2txt_etree, xml2txt_bs4, xml2txt_bs4_eu
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# XHTML fixtures are parsed with the HTML parser on purpose (as in get_text())
+warnings.filterwarnings('ignore', message='It looks like you.re using an HTML parser to parse an XML document')
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__)) + '/'
+FIXTURES_DIR = BENCHMARK_DIR + 'fixtures/'
+GOLDEN_DIR = BENCHMARK_DIR + 'golden/'
+
+
+def read_text(file_path):
+    """
+    Read the given file as UTF-8 text, as get_text() did before utils/doc2txt.py.
+
+    :param file_path: str
+    :return: str
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+# Extractors to benchmark: name, function taking a file path, extensions of the fixtures to process
+EXTRACTORS = [
+    ('xml2txt_etree', xml2txt_etree, ('xml',)),
+    ('xml2txt_bs4', xml2txt_bs4, ('xml',)),
+    ('xml2txt_bs4_eu', xml2txt_bs4_eu, ('xml',)),
+    ('html2txt_str', lambda file_path: html2txt_str(read_text(file_path)), ('html',)),
+    ('html2txt_str_eu', lambda file_path: html2txt_str_eu(read_text(file_path)), ('html',)),
+    ('doc2txt_path_eu', doc2txt_path_eu, ('xml', 'html')),
+]
+
+
+def get_fixture_list(extensions):
+    """
+    Get the sorted list of fixture file names with one of the given extensions.
+
+    :param extensions: tuple of str
+    :return: list of str
+    """
+    return sorted(f for f in os.listdir(FIXTURES_DIR) if f.split('.')[-1] in extensions)
+
+
+def extract(extractor, file_path):
+    """
+    Get the output of the given extractor for the given file:
+    ('text', text) or ('error', exception name).
+
+    :param extractor: function
+    :param file_path: str
+    :return: tuple (str, str)
+    """
+    try:
+        return 'text', extractor(file_path)
+    except Exception as e:
+        return 'error', type(e).__name__
+
+
+def benchmark_extractor(args):
+    """
+    Run the extractor with the given index in EXTRACTORS
+    repeat times on its fixtures (in a separate worker process).
+    Return the outputs of the fixtures and the measurements.
+
+    :param args: tuple (int, int)
+    :return: tuple (dict of { str : tuple (str, str) }, dict)
+    """
+    index, repeat = args
+    name, extractor, extensions = EXTRACTORS[index]
+    fixture_list = get_fixture_list(extensions)
+
+    outputs = {fixture: extract(extractor, FIXTURES_DIR + fixture) for fixture in fixture_list}
+
+    # Time the extractor without tracing, as tracemalloc slows down
+    # Python-heavy extractors (e.g., bs4) more than C-heavy ones (e.g., lxml)
+    start = time.perf_counter()
+    for i in range(repeat):
+        for fixture in fixture_list:
+            extract(extractor, FIXTURES_DIR + fixture)
+    elapsed = time.perf_counter() - start
+
+    # Measure the peak memory in a separate traced pass
+    tracemalloc.start()
+    for fixture in fixture_list:
+        extract(extractor, FIXTURES_DIR + fixture)
+    peak_python = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    size = sum(os.path.getsize(FIXTURES_DIR + fixture) for fixture in fixture_list)
+    measurements = {
+        'docs': len(fixture_list) * repeat,
+        'docs_per_sec': len(fixture_list) * repeat / elapsed,
+        'mb_per_sec': size * repeat / elapsed / 1024 ** 2,
+        'peak_python_mb': peak_python / 1024 ** 2,
+        # ru_maxrss is in kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else float('nan'),
+    }
+
+    return outputs, measurements
+
+
+def read_golden(name, fixture):
+    """
+    Get the golden output of the given extractor for the given fixture,
+    or None if there is no golden output.
+
+    :param name: str
+    :param fixture: str
+    :return: tuple (str, str) or None
+    """
+    golden_path = GOLDEN_DIR + name + '/' + fixture
+    for kind, extension in (('text', '.txt'), ('error', '.error')):
+        if os.path.exists(golden_path + extension):
+            with open(golden_path + extension, 'r', encoding='utf-8') as file:
+                return kind, file.read()
+    return None
+
+
+def write_golden(name, fixture, output):
+    """
+    Write the given output of the given extractor for the given fixture as its golden output.
+
+    :param name: str
+    :param fixture: str
+    :param output: tuple (str, str)
+    :return: None
+    """
+    golden_path = GOLDEN_DIR + name + '/' + fixture
+    os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+    for extension in ('.txt', '.error'):
+        if os.path.exists(golden_path + extension):
+            os.remove(golden_path + extension)
+
+    kind, value = output
+    with open(golden_path + ('.txt' if kind == 'text' else '.error'), 'w', encoding='utf-8') as file:
+        file.write(value)
+
+
+def run_benchmark(repeat=20, update_golden=False):
+    """
+    Benchmark each extractor in its own worker process,
+    check (or update) the golden outputs and print a report.
+    Return the number of outputs that differ from their golden output.
+
+    :param repeat: int
+    :param update_golden: bool
+    :return: int
+    """
+    # Use a new process for each extractor so that memory measurements are not shared
+    with Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(benchmark_extractor, [(i, repeat) for i in range(len(EXTRACTORS))], chunksize=1)
+
+    print('{:<18}{:>6}{:>12}{:>10}{:>14}{:>12}  {}'.format(
+        'extractor', 'docs', 'docs/sec', 'MB/sec', 'py peak MB', 'max RSS MB', 'golden'))
+
+    count_diff = 0
+    for (name, extractor, extensions), (outputs, measurements) in zip(EXTRACTORS, results):
+        diffs = []
+        for fixture, output in outputs.items():
+            if update_golden:
+                write_golden(name, fixture, output)
+            elif read_golden(name, fixture) != output:
+                diffs.append(fixture)
+
+        count_diff += len(diffs)
+        status = 'updated' if update_golden else ('OK' if not diffs else 'DIFF: ' + ', '.join(diffs))
+
+        print('{:<18}{:>6}{:>12.1f}{:>10.2f}{:>14.1f}{:>12.1f}  {}'.format(
+            name, measurements['docs'], measurements['docs_per_sec'], measurements['mb_per_sec'],
+            measurements['peak_python_mb'], measurements['max_rss_mb'], status))
+
+    return count_diff
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the text extractors against golden outputs.')
+    parser.add_argument('--repeat', type=int, default=20, help='number of runs over the fixtures per extractor')
+    parser.add_argument('--update-golden', action='store_true', help='(re)write the golden outputs')
+    args = parser.parse_args()
+
+    if run_benchmark(args.repeat, args.update_golden) != 0:
+        sys.exit(1)
@@ -6,79 +6,444 @@
 
 import requests
 import zipfile
-import io
 import os
-from datetime import datetime
-from get_cellar_ids import get_cellar_info_from_endpoint, get_cellar_ids_from_json_results, cellar_ids_to_file, \
-    get_cellar_ids_from_csv_file
+import random
+import re
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from get_cellar_ids import get_cellar_info_from_endpoint, get_cellar_id_set_from_json_results, cellar_ids_to_file, \
+    get_cellar_ids_from_csv_file, get_cellar_mtypes_from_json_results, get_cellar_mtypes_from_csv_file, \
+    get_cellar_worktypes_from_json_results, get_cellar_worktypes_from_csv_file, get_cellar_dates_from_json_results
 from get_text_from_cellar_files import get_text
-from utils.file_utils import text_to_str, get_subdir_list_from_path, print_list_to_file, to_json_output_file
+from utils.file_utils import get_file_list_from_path, text_to_str, get_subdir_list_from_path, get_zip_id_list_from_path, print_list_to_file, \
+    to_json_output_file, get_fanout_dir_list, get_id_path
+from utils.download_planner import plan_downloads
+from utils.download_scheduler import estimate_download_sizes, get_downloaded_sizes, get_priority_ids, \
+    load_download_sizes, save_download_sizes, schedule_downloads
+from utils.html2txt import html2txt_str_eu
+from utils.id_set import CellarIdSet
+from utils.output_writer import LogWriter, write_file_atomic
 from threading import Thread
 
 
-def check_ids_to_download(id_list, dir_to_check):
+# Share the pool of HTTP connections to the CELLAR server
+# between the requests of all the download threads
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=32))
+
+
+def check_ids_to_download(id_set, dir_to_check, fanout=0):
     """
-    Check whether the id in the given CELLAR id_list is already present
+    Check whether the id in the given CELLAR id_set is already present
     in the directory containing previously downloaded files.
-    The directory contains subdirectories named with a cellar id.
-    Return a list of cellar_ids absent from the subdirectory names.
+    The directory contains subdirectories named with a cellar id
+    and/or zip archives named <cellar_id>.zip,
+    under fanout levels of fan-out directories (see get_id_path()).
+    Return the set of cellar_ids absent from the subdirectory names.
+    Both sets are logged as txt files and as compact .ids files (see CellarIdSet.save()).
+
+    :param id_set: CellarIdSet
+    :param dir_to_check: str
+    :param fanout: int
+    :return: CellarIdSet
+    """
+
+    # Get CELLAR ids in the subdirectories containing the files already downloaded
+    # and in the names of the zip archives kept as single files
+    downloaded_id_set = get_downloaded_id_set(dir_to_check, fanout)
+    # print('ALREADY_DOWNLOADED:', len(downloaded_id_set))
+    cellar_ids_to_file(downloaded_id_set, timestamp, 'id_logs/in_dir_lists/', 'in_dir_')
+
+    # Get set of files that have not yet been downloaded
+    missing_id_set = id_set - downloaded_id_set
+    #print('SET_DIFF:', len(missing_id_set))
+    cellar_ids_to_file(missing_id_set, timestamp, 'id_logs/cellar_ids/')
 
-    :param id_list: list
+    return missing_id_set
+
+
+def get_downloaded_id_list(dir_to_check, fanout=0):
+    """
+    Get the CELLAR ids of the files already downloaded in the given directory,
+    i.e., the names of its subdirectories and of its <cellar_id>.zip archives,
+    or of those of its last level of fan-out directories if fanout is greater than 0.
+
+    :param dir_to_check: str
+    :param fanout: int
     :return: list
     """
+    downloaded_id_list = []
+    for dirpath in get_fanout_dir_list(dir_to_check, fanout):
+        downloaded_id_list += get_subdir_list_from_path(dirpath) + get_zip_id_list_from_path(dirpath)
+    return downloaded_id_list
 
-    # Get CELLAR ids in the subdirectories containing the files already downloaded
-    downloaded_files_list = get_subdir_list_from_path(dir_to_check)
-    # print('ALREADY_DOWNLOADED:', len(downloaded_files_list))
-    in_dir_name = 'id_logs/in_dir_lists/'
-    os.makedirs(os.path.dirname(in_dir_name), exist_ok=True)
-    print_list_to_file(in_dir_name + 'in_dir_' + timestamp + '.txt', downloaded_files_list)
 
-    # Get list of files that have not yet been downloaded
-    missing_ids_list = list(set(id_list) - set(downloaded_files_list))
-    #print('SET_DIFF:', len(missing_ids_list))
-    new_ids_dir_name = 'id_logs/cellar_ids/'
-    os.makedirs(os.path.dirname(new_ids_dir_name), exist_ok=True)
-    print_list_to_file(new_ids_dir_name + 'cellar_ids_' + timestamp + '.txt', missing_ids_list)
+def get_downloaded_id_set(dir_to_check, fanout=0):
+    """
+    Get the compact set of the CELLAR ids of the files already downloaded
+    in the given directory (see get_downloaded_id_list()),
+    without building an intermediate list of id str.
+
+    :param dir_to_check: str
+    :param fanout: int
+    :return: CellarIdSet
+    """
+    def iter_downloaded_ids():
+        for dirpath in get_fanout_dir_list(dir_to_check, fanout):
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        yield entry.name
+                    elif entry.is_file() and entry.name.endswith('.zip'):
+                        yield entry.name[:-len('.zip')]
 
-    return missing_ids_list
+    return CellarIdSet(iter_downloaded_ids())
 
 
-def rest_get_call(id):
-    """Send a GET request to download a zip file for the given id under the CELLAR URI."""
+def rest_get_call(id, accept=None, stream=False, range_start=0, language='eng', method='GET', timeout=(10, 60)):
+    """
+    Send a GET request to download a zip file for the given id under the CELLAR URI.
+    Set method to 'HEAD' to only get the headers of the response (e.g., its Content-Length).
+    If no accept header str is given (e.g., by plan_downloads()),
+    all the supported formats are accepted.
+    The language is the three-letter code of the language version to download.
+    If stream is True, the content is not downloaded until it is read.
+    If range_start is greater than 0, only the bytes from range_start onwards
+    are requested, to resume a partial download.
+    The timeout (connect, read) in seconds makes a stalled connection raise
+    an error instead of blocking the download thread.
+    """
 
     url = 'http://publications.europa.eu/resource/cellar/' + id
 
+    if accept is None:
+        accept = "application/zip;mtype=fmx4, application/xml;mtype=fmx4, application/xhtml+xml, text/html, text/html;type=simplified, application/msword, text/plain, application/xml;notice=object"
+
     headers = {
-        'Accept': "application/zip;mtype=fmx4, application/xml;mtype=fmx4, application/xhtml+xml, text/html, text/html;type=simplified, application/msword, text/plain, application/xml;notice=object",
-        'Accept-Language': "eng",
+        'Accept': accept,
+        'Accept-Language': language,
         'Content-Type': "application/x-www-form-urlencoded",
         'Host': "publications.europa.eu"#,
     }
 
-    response = requests.request("GET", url, headers=headers)
+    # Get the bytes as stored on the server so that byte ranges match the file
+    if stream:
+        headers['Accept-Encoding'] = "identity"
+
+    if range_start > 0:
+        headers['Range'] = "bytes=" + str(range_start) + "-"
+
+    response = session.request(method, url, headers=headers, stream=stream, timeout=timeout)
 
     return response
 
 
-def download_zip(response, folder_path):
+def probe_range(sub_list, accept_headers, probed_sizes, language='eng'):
+    """
+    Send a HEAD request for each id of the given list
+    and add the size of the response (Content-Length), if any, to the probed_sizes dict.
+
+    :param sub_list: list of str
+    :param accept_headers: dict of { str : str }
+    :param probed_sizes: dict of { str : int }
+    :param language: str
+    :return: None
     """
-    Downloads the zip file returned by the restful get request.
+    for id in sub_list:
+        try:
+            with rest_get_call(id, accept_headers.get(id), language=language, method='HEAD') as response:
+                if response.ok and response.headers.get('Content-Length', '').isdigit():
+                    probed_sizes[id] = int(response.headers['Content-Length'])
+        except requests.exceptions.RequestException as e:
+            # print('PROBE_FAILED:', id, e)
+            pass
+
+
+def probe_download_sizes(id_list, accept_headers=None, nthreads=11, language='eng'):
+    """
+    Get the size of the files to download for each id of the given id_list
+    with HEAD requests sent by multiple threads in parallel.
+    Ids whose response has no Content-Length are left out.
+
+    :param id_list: list of str
+    :param accept_headers: dict of { str : str }
+    :param nthreads: int
+    :param language: str
+    :return: dict of { str : int }
+    """
+    if accept_headers is None:
+        accept_headers = {}
+
+    probed_sizes = {}
+    threads = [Thread(target=probe_range, args=(id_list[i::nthreads], accept_headers, probed_sizes, language))
+               for i in range(nthreads)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    return probed_sizes
+
+
+def download_zip(response, part_path):
+    """
+    Downloads the zip file returned by the restful get request to the part_path file.
+    If the response is a partial content response (206) to a Range request,
+    the bytes are appended to the existing part_path file,
+    provided that they start at the end of the file.
+    Otherwise, the part_path file is (re)written from the start,
+    or removed if the partial content starts elsewhere, so that the next attempt
+    downloads the whole file again.
+    Return True if all the bytes of the zip file were received, else False.
+    If the transfer breaks, the bytes received so far are kept in the part_path file.
     Source: https://stackoverflow.com/questions/9419162/download-returned-zip-file-from-url?utm_medium=organic&utm_source=google_rich_qa&utm_campaign=google_rich_qa
+
+    :param response: requests Response
+    :param part_path: str
+    :return: bool
     """
-    z = zipfile.ZipFile(io.BytesIO(response.content))
-    z.extractall(folder_path)
+    # Get the expected size of the complete zip file
+    # e.g., 'Content-Range': 'bytes 1000-4999/5000'
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        expected_size = content_range.split('/')[-1]
+
+        # Check that the bytes start where the partial file ends
+        range_start = content_range.replace('bytes', '').strip().split('-')[0]
+        part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if range_start == '0':
+            mode = 'wb'
+        elif range_start.isdigit() and int(range_start) == part_size:
+            mode = 'ab'
+        else:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return False
+    else:
+        mode = 'wb'
+        expected_size = response.headers.get('Content-Length', '')
+
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    with open(part_path, mode) as f:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            f.write(chunk)
+
+    # If the size is unknown, rely on the zip file verification
+    if not expected_size.isdigit():
+        return True
 
+    return os.path.getsize(part_path) == int(expected_size)
 
-def process_range(sub_list, folder_path):
+
+def verify_zip(zip_path):
     """
-    Process a list of ids to download the corresponding zip files.
+    Check that the zip file in the given zip_path is complete and not corrupted,
+    i.e., that its central directory can be read and that the CRCs of its members match.
 
-    :param sub_list: list of str
+    :param zip_path: str
+    :return: bool
+    """
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def store_zip(part_path, folder_path, keep_zip=False):
+    """
+    Store the verified zip file in the given part_path.
+    If keep_zip is True, the archive is moved to a single file
+    named folder_path + '.zip'.
+    Otherwise, it is extracted in the folder_path directory and removed.
+
+    :param part_path: str
+    :param folder_path: str
+    :param keep_zip: bool
+    :return: None
+    """
+    if keep_zip:
+        zip_path = folder_path + '.zip'
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        os.replace(part_path, zip_path)
+    else:
+        with zipfile.ZipFile(part_path) as z:
+            z.extractall(folder_path)
+        os.remove(part_path)
+
+
+def get_retry_delay(attempt, response=None, backoff=2.0, max_delay=60.0):
+    """
+    Get the number of seconds to wait before retrying a request after the given attempt (starting at 0).
+    The Retry-After header of the response (in seconds or as an HTTP date), if any, is honoured.
+    Otherwise, the delay grows exponentially with the attempts (backoff, 2 * backoff, 4 * backoff, ...),
+    with random jitter so that the download threads do not retry at the same time.
+    The delay is capped at max_delay.
+
+    :param attempt: int
+    :param response: requests.Response or None
+    :param backoff: float
+    :param max_delay: float
+    :return: float
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), max_delay)
+
+    return min(backoff * 2 ** attempt * random.uniform(0.5, 1.5), max_delay)
+
+
+def download_id(id, folder_path, part_path, keep_zip=False, accept=None, max_attempts=3, language='eng',
+                backoff=2.0):
+    """
+    Download the files of the given id in the folder_path.
+    Zip files are first downloaded to the part_path file,
+    resuming any partial download of a previous attempt or run with a Range request,
+    and only stored once the zip file has been verified.
+    Return 'zip' or 'single' depending on the downloaded file,
+    or None if the response has no 'Content-Type'.
+    Failed attempts are retried after a delay growing from backoff seconds
+    or given by the Retry-After header of the response (see get_retry_delay()).
+    Client errors (4xx) other than 408 (Request Timeout) and 429 (Too Many Requests)
+    are raised at once, as retrying does not change their outcome.
+    Raise the last error if the download fails after max_attempts.
+
+    :param id: str
+    :param folder_path: str
+    :param part_path: str
+    :param keep_zip: bool
+    :param accept: str
+    :param max_attempts: int
+    :param language: str
+    :param backoff: float
+    :return: str or None
+    """
+    last_error = None
+
+    for attempt in range(max_attempts):
+
+        # Wait before retrying, longer after each failed attempt
+        if attempt > 0:
+            time.sleep(get_retry_delay(attempt - 1, getattr(last_error, 'response', None), backoff))
+
+        # Resume from the bytes already downloaded, if any
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        try:
+            with rest_get_call(id, accept, stream=True, range_start=resume_from, language=language) as response:
+
+                # If the partial file already holds all the bytes
+                if response.status_code == 416:
+                    complete = True
+
+                # Retry on error responses (e.g., 503 error pages),
+                # keeping the bytes already in the partial file
+                elif response.status_code not in (200, 206):
+                    response.raise_for_status()
+                    raise requests.exceptions.HTTPError('Unexpected status ' + str(response.status_code) + ': '
+                                                        + response.url, response=response)
+
+                # If the response's header does not contain the string 'Content-Type'
+                elif 'Content-Type' not in response.headers:
+                    # print('NO_CONTENT_TYPE:', response.content)
+                    return None
+
+                # If the string 'zip' appears as a value of 'Content-Type'
+                elif 'zip' in response.headers['Content-Type']:
+                    # Download the contents of the zip file in the partial file
+                    complete = download_zip(response, part_path)
+
+                # Partial content that is not a zip file does not belong
+                # to the partial zip file, which is removed to start over
+                elif response.status_code != 200:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise requests.exceptions.HTTPError('Unexpected partial content: ' + response.url,
+                                                        response=response)
+
+                # If the value of 'Content-Type' is not 'zip'
+                else:
+                    # Create a directory with the cellar_id name
+                    # and write the returned content in a file
+                    # with the same name
+                    out_file = folder_path + '/' + id + '.html'
+                    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+                    write_file_atomic(out_file, response.text)
+
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+
+                    return 'single'
+
+            if complete:
+                if verify_zip(part_path):
+                    store_zip(part_path, folder_path, keep_zip)
+                    return 'zip'
+
+                # Start over if the complete zip file is corrupted
+                os.remove(part_path)
+                last_error = zipfile.BadZipFile('Corrupted zip file: ' + part_path)
+
+            else:
+                last_error = IOError('Incomplete download: ' + part_path)
+
+        except (requests.exceptions.RequestException, OSError) as e:
+            # Do not retry client errors, except timeouts and rate limiting
+            status_code = e.response.status_code if getattr(e, 'response', None) is not None else None
+            if status_code is not None and 400 <= status_code < 500 and status_code not in (408, 429):
+                raise
+            last_error = e
+
+    raise last_error
+
+
+def process_range(sub_list, folder_path, keep_zip=False, accept_headers=None, partial_dir='data/partial_downloads/',
+                  fanout=0, failed_log=None):
+    """
+    Process a list of ids to download the corresponding zip files.
+    If keep_zip is True, the zip files are kept as <id>.zip archives
+    under folder_path instead of being extracted.
+    The accept_headers dict gives the Accept header to send for each id
+    (see plan_downloads()). As the manifestation types of the SPARQL results
+    are those of the English version, the Accept headers are only sent
+    for English downloads, and the other languages accept all the supported formats.
+    Zip files are downloaded to <id>.zip.part files in partial_dir,
+    so that interrupted downloads are resumed by later runs.
+    A failed download is logged in the failed_log LogWriter shared by the threads of the run
+    (by default, id_logs/failed_<date>-<time>.txt) and does not stop the download of the other ids.
+    The sub_list can also contain (id, language) tuples to download
+    the given language version of the id under folder_path/<language>/
+    (see multilingual harvesting). Plain ids are downloaded in English.
+    The files of each id are stored under fanout levels of fan-out directories
+    (e.g., folder_path/39/ca/39ca1c1c-3091-11eb-b27b-01aa75ed71a1/ with fanout=2, see get_id_path()).
+
+    :param sub_list: list of str or of tuple (str, str)
     :param folder_path: str
+    :param keep_zip: bool
+    :param accept_headers: dict of { str : str }
+    :param partial_dir: str
+    :param fanout: int
+    :param failed_log: LogWriter
     :return: write to files
     """
 
+    if accept_headers is None:
+        accept_headers = {}
+
+    # Log the other (failed) downloads
+    close_failed_log = failed_log is None
+    if failed_log is None:
+        failed_log = LogWriter('id_logs/failed_' + timestamp + '.txt')
+
     # Keep track of downloads
     zip_files = []
     single_files = []
@@ -93,47 +458,46 @@ def process_range(sub_list, folder_path):
     for id in sub_list:
         count_cellar_ids += 1
 
-        # Specify sub_folder_path to send results of request
-        sub_folder_path = folder_path + id
-
-        # Send Restful GET request for the given id
-        response = rest_get_call(id.strip())
+        # Get the language version to download
+        # and the language subdirectory to store it, if any
+        if isinstance(id, tuple):
+            id, language = id
+            language_dir = language + '/'
+        else:
+            language = 'eng'
+            language_dir = ''
 
-        # If the response's header contains the string 'Content-Type'
-        if 'Content-Type' in response.headers:
+        # Specify sub_folder_path to send results of request
+        sub_folder_path = get_id_path(folder_path + language_dir, id, fanout)
 
-            # If the string 'zip' appears as a value of 'Content-Type'
-            if 'zip' in response.headers['Content-Type']:
+        # Specify path of the partial zip file
+        part_path = partial_dir + language_dir + id + '.zip.part'
 
-                count_zip += 1
-                zip_files.append(id)
+        # Get the Accept header planned from the (English) manifestation types
+        accept = accept_headers.get(id) if language == 'eng' else None
 
-                # Download the contents of the zip file in the given folder
-                download_zip(response, sub_folder_path)
+        # Send Restful GET request for the given id
+        # and download the returned files
+        try:
+            download_type = download_id(id.strip(), sub_folder_path, part_path, keep_zip, accept, language=language)
+        except Exception as e:
+            # print('FAILED:', id, e)
+            download_type = None
 
-            # If the value of 'Content-Type' is not 'zip'
-            else:
-                count_single += 1
-                single_files.append(id)
+        if download_type == 'zip':
+            count_zip += 1
+            zip_files.append(id)
 
-                # Create a directory with the cellar_id name
-                # and write the returned content in a file
-                # with the same name
-                out_file = sub_folder_path + '/' + id + '.html'
-                os.makedirs(os.path.dirname(out_file), exist_ok=True)
-                with open(out_file, 'w') as f:
-                    f.write(response.text)
+        elif download_type == 'single':
+            count_single += 1
+            single_files.append(id)
 
         # If the response's header does not contain the string 'Content-Type'
+        # or if the download failed
         else:
             count_other += 1
-            other_downloads.append(id)
-            # print('NO_CONTENT_TYPE:', response.content)
-
-            #  Write the returned content in a file
-            # out_file = sub_folder_path + '/' + id + '.xml'
-            # with open(out_file, 'wb') as f:
-            #     f.write(response.text)
+            other_downloads.append(language_dir + id)
+            failed_log.write_line(language_dir + id)
 
     # log_text = ("\nQuery file: " + __file__ +
     #             "\nDownload date: " + str(datetime.today()) +
@@ -148,81 +512,384 @@ def process_range(sub_list, folder_path):
     #
     # print(log_text)
 
-    # Write the list of other (failed) downloads in a file
-    id_logs_path = 'id_logs/failed_' + timestamp + '.txt'
-    os.makedirs(os.path.dirname(id_logs_path), exist_ok=True)
-    with open(id_logs_path, 'w+') as f:
-        if len(other_downloads) != 0:
-            f.write('Failed downloads ' + timestamp + '\n' + str(other_downloads))
+    if close_failed_log:
+        failed_log.close()
+
+# URIs of CELLAR resources, e.g., http://publications.europa.eu/resource/cellar/d4661dab-51b2-11e7-a5ca-01aa75ed71a1
+CELLAR_URI = re.compile(r'https?://publications\.europa\.eu/resource/cellar/([^\s"\'<>]+)')
+
+
+def get_linked_resources(file_path, max_text_length=200):
+    """
+    Check whether the HTML file in the given file_path only contains links
+    to CELLAR resources instead of content, i.e., whether its text,
+    without the CELLAR URIs, is shorter than max_text_length characters.
+    Return the list of linked CELLAR resources (the part of the URIs after "cellar/"),
+    or an empty list if the file has content.
+
+    :param file_path: str
+    :param max_text_length: int
+    :return: list of str
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        contents = f.read()
+
+    resources = list(dict.fromkeys(CELLAR_URI.findall(contents)))
+    if not resources:
+        return []
+
+    # Get the text of the file without the URIs
+    text = CELLAR_URI.sub('', html2txt_str_eu(contents))
+    if len(re.sub(r'\s+', '', text)) >= max_text_length:
+        return []
+
+    return resources
+
+
+def process_linked_range(sub_list, staging_dir, partial_dir, language, downloaded_resources):
+    """
+    Download the given list of linked CELLAR resources to the staging_dir,
+    each one in a subdirectory named with the resource (with "/" replaced by "_").
+    Add the successfully downloaded resources to the downloaded_resources list.
+
+    :param sub_list: list of str
+    :param staging_dir: str
+    :param partial_dir: str
+    :param language: str
+    :param downloaded_resources: list of str
+    :return: None
+    """
+    for resource in sub_list:
+        resource_name = resource.replace('/', '_')
+        try:
+            download_type = download_id(resource, staging_dir + resource_name,
+                                        partial_dir + 'linked/' + resource_name + '.zip.part', language=language)
+        except Exception as e:
+            # print('FAILED:', resource, e)
+            download_type = None
+
+        if download_type is not None:
+            downloaded_resources.append(resource)
+
+
+def resolve_linked_docs(folder_path, staging_dir='data/linked_resources/', partial_dir='data/partial_downloads/',
+                        language='eng', nthreads=11, ids=None, fanout=0):
+    """
+    Find the HTML files downloaded for a CELLAR id (<folder_path>/<id>/<id>.html)
+    that only contain links to other CELLAR resources,
+    download the linked resources concurrently, each resource only once
+    even if several ids link to it, and attach their files to the directory of each linking id.
+
+    The downloaded files are renamed with the linked resource name
+    (e.g., d4661dab-51b2-11e7-a5ca-01aa75ed71a1.0006.03_DOC_1.html for a single HTML file,
+    or <resource>_<member name> for the members of a zip file).
+    Once all the files of all its linked resources are attached,
+    the link-only HTML file of an id is renamed <id>.html.links,
+    so that get_text() extracts the linked content instead of the links.
+    Resources already in the staging_dir (e.g., from a previous run) are not downloaded again.
+    If a list of ids is given, only the HTML files of these ids are checked
+    instead of all the HTML files under folder_path.
+    The ids are found under fanout levels of fan-out directories (see get_id_path()).
+    Return the list of ids whose linked resources were attached.
+
+    :param folder_path: str
+    :param staging_dir: str
+    :param partial_dir: str
+    :param language: str
+    :param nthreads: int
+    :param ids: list of str
+    :param fanout: int
+    :return: list of str
+    """
+    if ids is None:
+        html_file_list = get_file_list_from_path(folder_path, name='', extension='.html')
+    else:
+        html_file_list = [get_id_path(folder_path, id, fanout) + '/' + id + '.html' for id in ids
+                          if os.path.exists(get_id_path(folder_path, id, fanout) + '/' + id + '.html')]
+
+    # Map each linked resource to the ids linking to it
+    resource_ids = defaultdict(list)
+    link_only_files = {}
+    for file_path in html_file_list:
+        id = file_path.split('/')[-2]
+        if file_path.split('/')[-1] != id + '.html':
+            continue
+
+        resources = get_linked_resources(file_path)
+        if resources:
+            link_only_files[id] = file_path
+            for resource in resources:
+                resource_ids[resource].append(id)
+
+    # Download each resource not yet in the staging_dir once,
+    # with multiple threads in parallel
+    resource_list = sorted(resource for resource in resource_ids
+                           if not os.path.exists(staging_dir + resource.replace('/', '_')))
+    downloaded_resources = []
+    threads = [Thread(target=process_linked_range,
+                      args=(resource_list[i::nthreads], staging_dir, partial_dir, language, downloaded_resources))
+               for i in range(nthreads)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    # Attach the files of each resource to the linking ids.
+    # The files are named with the resource name (e.g., <resource>.html for a single HTML file)
+    # followed by their path in the resource directory (e.g., <resource>_<member>.xml for zip members),
+    # so that the parts of a resource and of different resources do not overwrite each other.
+    # An id is only resolved if all the files of all its linked resources were attached.
+    attached_ids = set()
+    failed_ids = set()
+    for resource, ids in resource_ids.items():
+        resource_name = resource.replace('/', '_')
+        resource_dir = staging_dir + resource_name
+        file_list = get_file_list_from_path(resource_dir, name='', extension='') if os.path.exists(resource_dir) else []
+        if len(file_list) == 0:
+            failed_ids.update(ids)
+            continue
+
+        for file_path in file_list:
+            file_name = os.path.relpath(file_path, resource_dir).replace(os.sep, '_')
+            if file_name != resource_name + '.html':
+                file_name = resource_name + '_' + file_name
+            for id in ids:
+                try:
+                    shutil.copy2(file_path, os.path.join(os.path.dirname(link_only_files[id]), file_name))
+                    attached_ids.add(id)
+                except OSError:
+                    failed_ids.add(id)
+
+    resolved_ids = attached_ids - failed_ids
+
+    # Exclude the link-only files of the resolved ids from text extraction
+    for id in resolved_ids:
+        os.replace(link_only_files[id], link_only_files[id] + '.links')
+
+    return sorted(resolved_ids)
+
 
 # Program starts here
 # ===================
 timestamp = str(datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-# Get SPARQL query from given file
-sparql_query = text_to_str('queries/sparql_queries/financial_domain_sparql_2019-01-07.rq')
-# print('SPARQL_PATH:', sparql_query)
-
-# Get CELLAR information from EU SPARQL endpoint (in JSON format)
-sparql_query_results = get_cellar_info_from_endpoint(sparql_query)
-
-# Output SPARQL results to file
-sparql_query_results_dir = "queries/sparql_query_results/"
-os.makedirs(os.path.dirname(sparql_query_results_dir), exist_ok=True)
-sparql_query_results_file = sparql_query_results_dir + "query_results_" + timestamp + ".json"
-to_json_output_file(sparql_query_results_file, sparql_query_results)
-
-# Create a list of ids from the SPARQL query results (in JSON format)
-id_list = sorted(get_cellar_ids_from_json_results(sparql_query_results))
-# print('ID_LIST:', len(id_list), id_list[:10])
-
-# # ALTERNATIVELY
-# # If you already have a CSV file with cellar ids,
-# # e.g., copy-pasted from browser results,
-# # specify file (path) containing the cellar IDs
-# # Input format: cellarURIs,lang,mtypes,workTypes,subjects,subject_ids
-# cellar_ids_file = 'queries/sparql_query_results/query_results_2019-01-07.csv'
-# #
-# # Create a list of CELLAR ids from the given CSV file
-# id_list = get_cellar_ids_from_csv_file(cellar_ids_file)
-
-# Output retrieved CELLAR ids list to txt file
-# with each ID on a new line
-cellar_ids_to_file(id_list, timestamp)
-
-
-# Create a list of not-yet-downloaded file ids by comparing the results in id_list with files present in the given directory
-# dir_to_check = None
-dir_to_check = "data/cellar_files_20201214-165041/"
-# dir_to_check = "dir_with_previously_downloaded_files/"
-if dir_to_check and os.path.exists(dir_to_check):
-    id_list = check_ids_to_download(id_list, dir_to_check)
-    # print('NEW_FILES_TO_DOWNLOAD:', len(id_list))
-
-# Specify folder path to store downloaded files
-dwnld_folder_path = "data/cellar_files_" + timestamp + "/"
-
-# Run multiple threads in parallel to download the files
-# using the process_range(sub_list, dwnld_folder_path) function
-# Adapted from: https://stackoverflow.com/questions/16982569/making-multiple-api-calls-in-parallel-using-python-ipython
-nthreads = 11
-threads = []
-for i in range(nthreads):  # Four times...
-    # print('ID_LIST:', id_list[i::nthreads])
-    sub_list = id_list[i::nthreads]
-    t = Thread(target=process_range, args=(sub_list, dwnld_folder_path))
-    threads.append(t)
-
-# start the threads
-[t.start() for t in threads]
-# wait for the threads to finish
-[t.join() for t in threads]
-
-
-# Generate text files for downloaded XML and HTML files
-# Set replace_existing to True to replace existing text files.
-# To process only new files, set replace_existing to False (default).
-# Usage: get_text(input_path, output_dir, replace_existing=False)
-txt_folder_path = "data/text_files_" + dwnld_folder_path.split('_')[-1]
-# print('TXT_DIR_PATH:', txt_folder_path)
-get_text(dwnld_folder_path, txt_folder_path, replace_existing=False)
\ No newline at end of file
+if __name__ == '__main__':
+    # Get SPARQL query from given file
+    sparql_query = text_to_str('queries/sparql_queries/financial_domain_sparql_2019-01-07.rq')
+    # print('SPARQL_PATH:', sparql_query)
+
+    # Specify folder path to cache the SPARQL results (gzipped JSON)
+    # under the hash of the normalized query.
+    # Cached results are reused for sparql_cache_ttl seconds
+    # and the cache is kept under sparql_cache_max_size bytes.
+    # Set sparql_cache_dir to None to always query the endpoint
+    # and output the results to a timestamped JSON file.
+    sparql_cache_dir = "queries/sparql_query_cache/"
+    sparql_cache_ttl = 24 * 60 * 60
+    sparql_cache_max_size = 512 * 1024 * 1024
+
+    # Get CELLAR information from EU SPARQL endpoint (in JSON format)
+    sparql_query_results = get_cellar_info_from_endpoint(sparql_query, sparql_cache_dir, sparql_cache_ttl,
+                                                         sparql_cache_max_size)
+
+    # Output SPARQL results to file
+    if sparql_cache_dir is None:
+        sparql_query_results_dir = "queries/sparql_query_results/"
+        os.makedirs(os.path.dirname(sparql_query_results_dir), exist_ok=True)
+        sparql_query_results_file = sparql_query_results_dir + "query_results_" + timestamp + ".json"
+        to_json_output_file(sparql_query_results_file, sparql_query_results)
+
+    # Create a compact set of unique ids from the SPARQL query results (in JSON format).
+    # The ids are kept as a CellarIdSet (see utils/id_set.py) until the downloads are planned.
+    id_set = get_cellar_id_set_from_json_results(sparql_query_results)
+    # print('ID_SET:', len(id_set))
+
+    # # ALTERNATIVELY
+    # # If you already have a CSV file with cellar ids,
+    # # e.g., copy-pasted from browser results,
+    # # specify file (path) containing the cellar IDs
+    # # Input format: cellarURIs,lang,mtypes,workTypes,subjects,subject_ids
+    # cellar_ids_file = 'queries/sparql_query_results/query_results_2019-01-07.csv'
+    # #
+    # # Create a list of CELLAR ids from the given CSV file
+    # id_set = CellarIdSet(get_cellar_ids_from_csv_file(cellar_ids_file))
+    # and set id_mtypes_dict, id_worktypes_dict and id_dates_dict below to
+    # get_cellar_mtypes_from_csv_file(cellar_ids_file), get_cellar_worktypes_from_csv_file(cellar_ids_file) and {}
+
+    # Output retrieved CELLAR ids to txt file
+    # with each ID on a new line, and to a compact .ids file
+    cellar_ids_to_file(id_set, timestamp)
+
+
+    # Set languages to a list of three-letter language codes (e.g., ['eng', 'fra', 'deu'])
+    # to download the files of each language from the same SPARQL results.
+    # The files of each language are stored in a <language>/ subdirectory
+    # of the download and text folders.
+    # Set languages to None to download the English files only, without language subdirectories.
+    languages = None
+
+    # Create a set of not-yet-downloaded file ids by comparing the results in id_set with files present in the given directory
+    # dir_to_check = None
+    dir_to_check = "data/cellar_files_20201214-165041/"
+    # dir_to_check = "dir_with_previously_downloaded_files/"
+    # Set dir_to_check_fanout to the number of fan-out directory levels of dir_to_check
+    # (0 for directories downloaded without fan-out, see fanout below).
+    dir_to_check_fanout = 0
+    # For multilingual downloads, the <language>/ subdirectories of dir_to_check are checked below.
+    if languages is None and dir_to_check and os.path.exists(dir_to_check):
+        id_set = check_ids_to_download(id_set, dir_to_check, dir_to_check_fanout)
+        # print('NEW_FILES_TO_DOWNLOAD:', len(id_set))
+
+    # Get the manifestation types and dates of the ids to download from the SPARQL query results,
+    # and the work types of all the ids (the typical size of each work type
+    # is estimated from the earlier downloads, see estimate_download_sizes())
+    id_mtypes_dict = get_cellar_mtypes_from_json_results(sparql_query_results, id_set)
+    id_worktypes_dict = get_cellar_worktypes_from_json_results(sparql_query_results)
+    id_dates_dict = get_cellar_dates_from_json_results(sparql_query_results, id_set)
+
+    # Create a sorted list of the ids to download
+    id_list = id_set.to_list()
+
+    # Plan the downloads using the manifestation types of each id:
+    # request only the cheapest extractable format of each id,
+    # and skip ids without textual manifestation.
+    # The requests are ordered by expected size and priority when they are scheduled below.
+    # The manifestation types are those of the English version (see the query),
+    # so the other languages are requested with the default Accept header.
+    # Set plan_by_mtypes to False to request all formats for every id.
+    plan_by_mtypes = True
+    accept_headers = {}
+    if plan_by_mtypes:
+        id_list, accept_headers, skipped_ids = plan_downloads(id_list, id_mtypes_dict)
+        if len(skipped_ids) != 0:
+            skipped_ids_dir_name = 'id_logs/skipped_ids/'
+            os.makedirs(os.path.dirname(skipped_ids_dir_name), exist_ok=True)
+            print_list_to_file(skipped_ids_dir_name + 'skipped_ids_' + timestamp + '.txt', skipped_ids)
+
+    # Specify folder path to store downloaded files
+    dwnld_folder_path = "data/cellar_files_" + timestamp + "/"
+
+    # Set fanout to the number of levels of fan-out directories
+    # named with the first characters of the CELLAR ids
+    # to store the downloaded and text files of each id, e.g.,
+    # data/cellar_files_<date>-<time>/39/ca/39ca1c1c-3091-11eb-b27b-01aa75ed71a1/ with fanout = 2,
+    # so that no directory holds more than a few thousand entries.
+    # Set fanout to 0 to store all the ids directly under the download and text folders.
+    fanout = 2
+
+    # Set keep_zip to True to store each downloaded zip file as a single
+    # <CELLAR_ID>.zip archive instead of extracting it in a <CELLAR_ID>/ directory.
+    # get_text() reads the XML and HTML files directly from the archives.
+    keep_zip = False
+
+    # Specify folder path to store partial zip files.
+    # Interrupted downloads are resumed from these files by the next runs.
+    partial_dir = "data/partial_downloads/"
+
+    # Create the list of downloads
+    # For multilingual downloads, each id is downloaded in each language
+    # that is not present in the <language>/ subdirectory of dir_to_check.
+    if languages is None:
+        download_list = id_list
+    else:
+        download_list = []
+        language_missing_ids = {}
+        for language in languages:
+            language_dir_to_check = (dir_to_check or '') + language + '/'
+            if dir_to_check and os.path.exists(language_dir_to_check):
+                language_missing_ids[language] = id_set - get_downloaded_id_set(language_dir_to_check,
+                                                                                 dir_to_check_fanout)
+            else:
+                language_missing_ids[language] = None
+
+        # Keep the order of the ids and interleave their languages
+        for id in id_list:
+            for language in languages:
+                if language_missing_ids[language] is None or id in language_missing_ids[language]:
+                    download_list.append((id, language))
+
+    # Schedule the downloads across the download threads.
+    # The size of each download is estimated from the sizes of earlier downloads
+    # (stored in download_sizes_path), the work types and the manifestation types of the ids,
+    # and, if probe_sizes is True, from HEAD requests for the ids without earlier downloads.
+    # The high-priority ids are downloaded first: the ids dated since priority_since (e.g., '2020-01-01'),
+    # of one of the priority_work_types (e.g., ['http://publications.europa.eu/ontology/cdm#regulation']),
+    # or in the priority_ids list. Set them to None to schedule all the ids by size only.
+    # The largest downloads are then spread across the threads
+    # so that they all finish at about the same time.
+    nthreads = 11
+    download_sizes_path = 'id_logs/download_sizes.json'
+    probe_sizes = False
+    priority_since = None
+    priority_work_types = None
+    priority_ids = None
+
+    past_sizes = load_download_sizes(download_sizes_path)
+    probed_sizes = {}
+    if probe_sizes:
+        probed_sizes = probe_download_sizes([id for id in id_list if id not in past_sizes], accept_headers, nthreads)
+    expected_sizes = estimate_download_sizes(id_list, id_mtypes_dict, id_worktypes_dict, past_sizes, probed_sizes)
+    high_priority_ids = get_priority_ids(id_list, id_dates_dict, priority_since, id_worktypes_dict,
+                                         priority_work_types, priority_ids)
+    sub_lists = schedule_downloads(download_list, nthreads, expected_sizes, high_priority_ids)
+
+    # Run multiple threads in parallel to download the files
+    # using the process_range(sub_list, dwnld_folder_path, keep_zip, accept_headers, partial_dir, fanout, failed_log) function
+    # The failed downloads of all the threads are logged in a single file, one id per line.
+    # Adapted from: https://stackoverflow.com/questions/16982569/making-multiple-api-calls-in-parallel-using-python-ipython
+    failed_log = LogWriter('id_logs/failed_' + timestamp + '.txt', header='Failed downloads ' + timestamp)
+    threads = []
+    for i in range(nthreads):  # Four times...
+        # print('ID_LIST:', sub_lists[i])
+        sub_list = sub_lists[i]
+        t = Thread(target=process_range, args=(sub_list, dwnld_folder_path, keep_zip, accept_headers, partial_dir, fanout,
+                                               failed_log))
+        threads.append(t)
+
+    # start the threads
+    [t.start() for t in threads]
+    # wait for the threads to finish
+    [t.join() for t in threads]
+    failed_log.close()
+
+    # Store the sizes of the downloaded files to schedule the next runs
+    if languages is None:
+        save_download_sizes(download_sizes_path, get_downloaded_sizes(dwnld_folder_path, id_list, fanout))
+    else:
+        for language in languages:
+            save_download_sizes(download_sizes_path,
+                                get_downloaded_sizes(dwnld_folder_path + language + '/', id_list, fanout))
+
+    # Download the contents linked by the HTML files that only contain CELLAR URIs
+    # and attach them to the ids of these files
+    if languages is None:
+        linked_ids = resolve_linked_docs(dwnld_folder_path, partial_dir=partial_dir)
+    else:
+        linked_ids = []
+        for language in languages:
+            if os.path.exists(dwnld_folder_path + language + '/'):
+                linked_ids += resolve_linked_docs(dwnld_folder_path + language + '/',
+                                                  'data/linked_resources/' + language + '/',
+                                                  partial_dir + language + '/', language)
+    if len(linked_ids) != 0:
+        linked_ids_dir_name = 'id_logs/linked_ids/'
+        os.makedirs(os.path.dirname(linked_ids_dir_name), exist_ok=True)
+        print_list_to_file(linked_ids_dir_name + 'linked_ids_' + timestamp + '.txt', linked_ids)
+
+    # Generate text files for downloaded XML and HTML files
+    # Set replace_existing to True to replace existing text files.
+    # To process only new files, set replace_existing to False (default).
+    # Usage: get_text(input_path, output_dir, replace_existing=False)
+    # Each file is extracted in an isolated process with a time limit (s)
+    # and a memory limit (bytes). Files that fail or exceed the limits
+    # are recorded in the quarantine file and skipped by later runs
+    # (set force=True to process them again).
+    txt_folder_path = "data/text_files_" + dwnld_folder_path.split('_')[-1]
+    # print('TXT_DIR_PATH:', txt_folder_path)
+    if languages is None:
+        get_text(dwnld_folder_path, txt_folder_path, replace_existing=False, timeout=300, memory_limit=4 * 1024 ** 3,
+                 quarantine_path='id_logs/quarantine.jsonl', fanout=fanout)
+    else:
+        for language in languages:
+            if os.path.exists(dwnld_folder_path + language + '/'):
+                get_text(dwnld_folder_path + language + '/', txt_folder_path + language + '/', replace_existing=False,
+                         timeout=300, memory_limit=4 * 1024 ** 3, quarantine_path='id_logs/quarantine.jsonl',
+                         fanout=fanout)
@@ -9,25 +9,163 @@ It includes a function create a list of CELLAR ids to be used for downloading th
 The program also has a function to return a list of CELLAR ids
 from a CSV file that contains a set of information about each document.
 """
+import gzip
+import hashlib
+import json
 import os
+import re
+import time
 
 import pandas as pd
 from datetime import datetime
 from utils.file_utils import text_to_str, to_json_output_file, print_list_to_file
+from utils.id_set import CellarIdSet
 from SPARQLWrapper import SPARQLWrapper, JSON, POST
 
 
-def get_cellar_info_from_endpoint(sparql_query):
+# Tokens of a SPARQL query: IRIs and strings (which may contain "#"),
+# comments, and any other character
+SPARQL_TOKENS = re.compile(r'<[^<>"{}|^`\\\s]*>|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|#[^\n]*|[^<"\'#]+|.')
+
+
+def normalize_sparql_query(sparql_query):
+    """
+    Normalize the given sparql_query so that queries that differ only
+    by their comments or whitespace have the same cache key:
+    remove comments (but not "#" in IRIs and strings)
+    and replace sequences of whitespace with a single space.
+    IRIs and strings are kept verbatim, as their whitespace is significant.
+
+    :param sparql_query: str
+    :return: str
+    """
+    parts = []
+    other_text = ''
+    for token in SPARQL_TOKENS.findall(sparql_query):
+        if token.startswith('#'):
+            continue
+
+        # Keep IRIs and strings verbatim
+        if len(token) > 1 and (token[0], token[-1]) in (('<', '>'), ('"', '"'), ("'", "'")):
+            parts.append(re.sub(r'\s+', ' ', other_text))
+            parts.append(token)
+            other_text = ''
+        else:
+            other_text += token
+
+    parts.append(re.sub(r'\s+', ' ', other_text))
+    return ''.join(parts).strip()
+
+
+def get_query_cache_path(sparql_query, cache_dir):
+    """
+    Get the path of the cache file of the given sparql_query in the given cache_dir,
+    named with the SHA-256 hash of the normalized query.
+
+    :param sparql_query: str
+    :param cache_dir: dir path str ending with "/"
+    :return: str
+    """
+    query_hash = hashlib.sha256(normalize_sparql_query(sparql_query).encode('utf-8')).hexdigest()
+    return cache_dir + query_hash + '.json.gz'
+
+
+def get_cached_query_results(sparql_query, cache_dir, ttl):
+    """
+    Get the cached results of the given sparql_query from the given cache_dir
+    if they are less than ttl seconds old.
+    Return None if there are no such results.
+
+    :param sparql_query: str
+    :param cache_dir: dir path str ending with "/"
+    :param ttl: int
+    :return: json dict or None
+    """
+    cache_path = get_query_cache_path(sparql_query, cache_dir)
+
+    if not os.path.exists(cache_path) or time.time() - os.path.getmtime(cache_path) > ttl:
+        return None
+
+    try:
+        with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Record the use of the cache file for the eviction of the least recently used files
+    os.utime(cache_path, (time.time(), os.path.getmtime(cache_path)))
+
+    return results
+
+
+def cache_query_results(sparql_query, results, cache_dir, max_cache_size):
+    """
+    Store the given results of the given sparql_query as compact, gzipped JSON
+    in the given cache_dir and evict the least recently used cache files
+    if the cache_dir is larger than max_cache_size bytes.
+
+    :param sparql_query: str
+    :param results: json dict
+    :param cache_dir: dir path str ending with "/"
+    :param max_cache_size: int
+    :return: None
+    """
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    cache_path = get_query_cache_path(sparql_query, cache_dir)
+
+    # Write to a temporary file first so that readers never see a partial file
+    tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(results, f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+    evict_query_cache(cache_dir, max_cache_size)
+
+
+def evict_query_cache(cache_dir, max_cache_size):
+    """
+    Remove the least recently used cache files in the given cache_dir
+    until its size is at most max_cache_size bytes.
+
+    :param cache_dir: dir path str ending with "/"
+    :param max_cache_size: int
+    :return: None
+    """
+    cache_files = [f for f in os.scandir(cache_dir) if f.is_file() and f.name.endswith('.json.gz')]
+    cache_files.sort(key=lambda f: f.stat().st_atime)
+
+    cache_size = sum(f.stat().st_size for f in cache_files)
+    for f in cache_files:
+        if cache_size <= max_cache_size:
+            break
+        cache_size -= f.stat().st_size
+        os.remove(f.path)
+
+
+def get_cellar_info_from_endpoint(sparql_query, cache_dir=None, ttl=24 * 60 * 60, max_cache_size=512 * 1024 * 1024):
     """
     Send the given sparql_query to the EU Sparql endpoint
     and retrieve and return the results in JSON format.
 
+    If a cache_dir is given, the results are cached under the hash
+    of the normalized query, and cached results that are less than
+    ttl seconds old are returned without querying the endpoint.
+    The size of the cache_dir is kept under max_cache_size bytes.
+
     :param sparql_query: str
+    :param cache_dir: dir path str ending with "/"
+    :param ttl: int
+    :param max_cache_size: int
     :return: json dict
     """
     # sparql_query = "r'" + sparql_query + "'"
     # print('QUERY:', sparql_query)
 
+    if cache_dir is not None:
+        cached_results = get_cached_query_results(sparql_query, cache_dir, ttl)
+        if cached_results is not None:
+            return cached_results
+
     endpoint = "http://publications.europa.eu/webapi/rdf/sparql" # 2020-06-12 THIS
 
     ## USING SPARQLWrapper
@@ -42,6 +180,9 @@ def get_cellar_info_from_endpoint(sparql_query):
     results = sparql.query().convert()
     # print('RESULTS:', results)
 
+    if cache_dir is not None:
+        cache_query_results(sparql_query, results, cache_dir, max_cache_size)
+
     return results
 
 
@@ -80,6 +221,132 @@ def get_cellar_ids_from_json_results(cellar_results):
     return cellar_ids_list
 
 
+def get_cellar_id_set_from_json_results(cellar_results):
+    """
+    Create a compact set of the unique CELLAR ids (see utils/id_set.py)
+    from the given cellar_results JSON dictionary and return the set,
+    without building an intermediate list of id str.
+
+    :param cellar_results: dict
+    :return: CellarIdSet
+    """
+    return CellarIdSet(result["cellarURIs"]["value"].split('/')[-1] for result in cellar_results["results"]["bindings"])
+
+
+def get_cellar_mtypes_from_csv_file(file_path):
+    """
+    Get the manifestation types of each CELLAR id from the CSV file in the given file_path.
+    Return a dictionary where key=CELLAR id, value=list of manifestation types.
+
+    Input file format:
+    cellarURIs,lang,mtypes,workTypes,subjects,subject_ids
+
+    :param file_path: file path str
+    :return: dict of { str : list of str }
+    """
+    # Read the CSV into a pandas data frame (df)
+    df = pd.read_csv(file_path, delimiter=',')
+
+    # Get manifestation types separated by "|" for each CELLAR id
+    csv_mtypes_dict = {}
+    for url, mtypes in zip(df.loc[ : , 'cellarURIs' ], df.loc[ : , 'mtypes' ]):
+        csv_mtypes_dict[url.split('/')[-1]] = str(mtypes).split('|')
+
+    return csv_mtypes_dict
+
+
+def get_cellar_mtypes_from_json_results(cellar_results, id_set=None):
+    """
+    Create a dictionary of the manifestation types of each CELLAR id
+    from the given cellar_results JSON dictionary and return the dictionary.
+    If an id_set is given, only the ids in the id_set (e.g., the ids to download) are kept.
+
+    :param cellar_results: dict
+    :param id_set: CellarIdSet
+    :return: dict of { str : list of str }
+    """
+    results_list = cellar_results["results"]["bindings"]
+
+    cellar_mtypes_dict = {}
+    for result in results_list:
+        cellar_id = result["cellarURIs"]["value"].split('/')[-1]
+        if id_set is not None and cellar_id not in id_set:
+            continue
+        mtypes = result["mtypes"]["value"].split('|') if "mtypes" in result else []
+        cellar_mtypes_dict[cellar_id] = mtypes
+
+    return cellar_mtypes_dict
+
+
+def get_cellar_worktypes_from_csv_file(file_path):
+    """
+    Get the work types of each CELLAR id from the CSV file in the given file_path.
+    Return a dictionary where key=CELLAR id, value=list of work types.
+
+    Input file format:
+    cellarURIs,lang,mtypes,workTypes,subjects,subject_ids
+
+    :param file_path: file path str
+    :return: dict of { str : list of str }
+    """
+    # Read the CSV into a pandas data frame (df)
+    df = pd.read_csv(file_path, delimiter=',')
+
+    # Get work types separated by "|" for each CELLAR id
+    csv_worktypes_dict = {}
+    for url, worktypes in zip(df.loc[ : , 'cellarURIs' ], df.loc[ : , 'workTypes' ]):
+        csv_worktypes_dict[url.split('/')[-1]] = str(worktypes).split('|')
+
+    return csv_worktypes_dict
+
+
+def get_cellar_worktypes_from_json_results(cellar_results, id_set=None):
+    """
+    Create a dictionary of the work types of each CELLAR id
+    from the given cellar_results JSON dictionary and return the dictionary.
+    If an id_set is given, only the ids in the id_set (e.g., the ids to download) are kept.
+
+    :param cellar_results: dict
+    :param id_set: CellarIdSet
+    :return: dict of { str : list of str }
+    """
+    results_list = cellar_results["results"]["bindings"]
+
+    cellar_worktypes_dict = {}
+    for result in results_list:
+        cellar_id = result["cellarURIs"]["value"].split('/')[-1]
+        if id_set is not None and cellar_id not in id_set:
+            continue
+        worktypes = result["workTypes"]["value"].split('|') if "workTypes" in result else []
+        cellar_worktypes_dict[cellar_id] = worktypes
+
+    return cellar_worktypes_dict
+
+
+def get_cellar_dates_from_json_results(cellar_results, id_set=None):
+    """
+    Create a dictionary of the document dates (e.g., '2020-12-03') of each CELLAR id
+    from the given cellar_results JSON dictionary and return the dictionary.
+    Ids without dates in the results (e.g., if the query does not select ?dates) get an empty list.
+    If an id_set is given, only the ids in the id_set (e.g., the ids to download) are kept.
+
+    :param cellar_results: dict
+    :param id_set: CellarIdSet
+    :return: dict of { str : list of str }
+    """
+    results_list = cellar_results["results"]["bindings"]
+
+    cellar_dates_dict = {}
+    for result in results_list:
+        cellar_id = result["cellarURIs"]["value"].split('/')[-1]
+        if id_set is not None and cellar_id not in id_set:
+            continue
+        dates = [date for date in result["dates"]["value"].split('|') if date] if "dates" in result else []
+        cellar_dates_dict[cellar_id] = dates
+
+    return cellar_dates_dict
+
+
 def query_results_to_json(query_results):
     """
     Output query results to json file.
@@ -90,16 +357,22 @@ def query_results_to_json(query_results):
     to_json_output_file('sparql_query_results/query_results_'+timestamp+'.json', query_results)
 
 
-def cellar_ids_to_file(id_list, timestamp):
+def cellar_ids_to_file(id_list, timestamp, dir_name="cellar_ids/", prefix='cellar_ids_'):
     """
     Output the list of CELLAR ids to txt file.
-    :param id_list: list
+    If the ids are a CellarIdSet, they are also saved in its compact binary form
+    in a .ids file next to the txt file (see CellarIdSet.load()).
+    :param id_list: list or CellarIdSet
+    :param timestamp: str
+    :param dir_name: str
+    :param prefix: str
     :return: None
     """
-    dir_name = "cellar_ids/"
     os.makedirs(os.path.dirname(dir_name), exist_ok=True)
     # Usage: print_list_to_file(file_name, data)
-    print_list_to_file(dir_name + 'cellar_ids_' + timestamp + '.txt', id_list)
+    print_list_to_file(dir_name + prefix + timestamp + '.txt', id_list)
+    if isinstance(id_list, CellarIdSet):
+        id_list.save(dir_name + prefix + timestamp + '.ids')
 
 
 if __name__ == '__main__':
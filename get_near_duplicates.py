@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+    Program to find near-duplicate documents in the text files
+    generated by get_text() (e.g., consolidated versions, corrigenda,
+    and the multiple Formex parts of a single act).
+
+    A MinHash signature of the word shingles of each text file
+    is computed in parallel. The signatures are bucketed
+    with Locality-Sensitive Hashing (LSH) so that only the documents
+    that share a bucket are compared. Documents whose estimated
+    Jaccard similarity is above the given threshold are grouped in clusters.
+
+    Usage: get_near_duplicates(txt_dir, output_dir, threshold=0.8)
+
+    The program outputs:
+    - near_duplicates_<date>-<time>.json: list of clusters of near-duplicate file names,
+    - deduplicated_<date>-<time>.txt: list of text file paths without near-duplicates,
+      where each cluster is represented by its longest document.
+
+    Memory use is bounded by the size of the signatures
+    (num_perm x 4 bytes per document), as the texts are not kept in memory.
+"""
+
+import os
+import re
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from multiprocessing import Pool
+import numpy as np
+from utils.file_utils import get_file_list_from_path, print_list_to_file, to_json_output_file
+
+# Mersenne prime used for the universal hash functions of the permutations
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Number of words in each shingle
+SHINGLE_SIZE = 5
+
+WORD = re.compile(r'\w+')
+
+
+def get_permutations(num_perm, seed=1):
+    """
+    Get the parameters (a, b) of the num_perm hash functions
+    h(x) = (a * x + b) mod MERSENNE_PRIME used to simulate permutations.
+
+    :param num_perm: int
+    :param seed: int
+    :return: tuple (numpy array, numpy array)
+    """
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def get_shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    Get the 32-bit hashes of the word shingles of the given text.
+    Texts shorter than shingle_size words are a single shingle.
+
+    :param text: str
+    :param shingle_size: int
+    :return: numpy array of uint64
+    """
+    words = WORD.findall(text.lower())
+    shingles = {' '.join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+def get_minhash(text, permutations):
+    """
+    Get the MinHash signature of the given text
+    for the given permutations (see get_permutations()).
+    Return None if the text has no words.
+
+    :param text: str
+    :param permutations: tuple (numpy array, numpy array)
+    :return: numpy array of uint32 or None
+    """
+    if WORD.search(text) is None:
+        return None
+
+    a, b = permutations
+    hashes = get_shingle_hashes(text)
+
+    # Get the minimum hash of each permutation,
+    # processing the shingles in blocks to bound memory use
+    signature = np.full(len(a), MAX_HASH, dtype=np.uint64)
+    for start in range(0, len(hashes), 4096):
+        block = hashes[start:start + 4096]
+        permuted = ((np.outer(a, block) + b[:, np.newaxis]) % MERSENNE_PRIME) & MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=1))
+
+    return signature.astype(np.uint32)
+
+
+def file_minhash(args):
+    """
+    Get the MinHash signature of the text file in the given file_path
+    (worker function of get_near_duplicates()).
+
+    :param args: tuple (str, tuple)
+    :return: tuple (str, int, numpy array or None)
+    """
+    file_path, permutations = args
+    with open(file_path, 'r') as file:
+        text = file.read()
+    return file_path, len(text), get_minhash(text, permutations)
+
+
+def find_root(parents, i):
+    """
+    Find the root of the given index in the given union-find parents list
+    (with path halving).
+
+    :param parents: list of int
+    :param i: int
+    :return: int
+    """
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def get_lsh_clusters(signatures, bands, rows, threshold):
+    """
+    Bucket the given signatures by bands of rows and group the documents
+    whose estimated similarity reaches the given threshold into clusters
+    using a union-find structure.
+    Within each bucket, the members are only compared with the first member of the bucket
+    (in a single vectorised comparison), so that the memory and the time
+    grow linearly with the size of the buckets, even for large clusters
+    of identical documents (e.g., boilerplate corrigenda).
+    Return the list of clusters with more than one document.
+
+    :param signatures: numpy array of uint32 (documents x num_perm)
+    :param bands: int
+    :param rows: int
+    :param threshold: float
+    :return: list of list of int
+    """
+    count = len(signatures)
+    parents = list(range(count))
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_signatures = signatures[:, band * rows:(band + 1) * rows]
+        for index in range(count):
+            buckets[band_signatures[index].tobytes()].append(index)
+
+        for bucket in buckets.values():
+            if len(bucket) > 1:
+                first = bucket[0]
+                others = np.array(bucket[1:])
+
+                # Estimate the similarity of the members with the first member
+                similarities = (signatures[others] == signatures[first]).mean(axis=1)
+                for j in others[similarities >= threshold]:
+                    root_i, root_j = find_root(parents, first), find_root(parents, int(j))
+                    if root_i != root_j:
+                        parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = defaultdict(list)
+    for i in range(count):
+        clusters[find_root(parents, i)].append(i)
+
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def get_near_duplicates(txt_dir, output_dir, threshold=0.8, num_perm=128, bands=16, processes=None):
+    """
+    Find the near-duplicate text files in the given txt_dir
+    and output the clusters of near-duplicates
+    and the deduplicated list of text files in the given output_dir.
+    Two documents are near-duplicates if the estimated Jaccard similarity
+    of their shingles is at least the given threshold.
+    The num_perm signature values are split into the given number of LSH bands.
+    The signatures are computed with the given number of processes
+    (default: number of CPUs).
+    Files without any word (and hence without signature) are not near-duplicates
+    of any other file and are kept in the deduplicated list.
+
+    :param txt_dir: dir path str ending with "/"
+    :param output_dir: dir path str ending with "/"
+    :param threshold: float
+    :param num_perm: int
+    :param bands: int
+    :param processes: int
+    :return: tuple (list of list of str, list of str)
+    """
+    assert num_perm % bands == 0, "The number of permutations must be a multiple of the number of bands."
+    rows = num_perm // bands
+
+    timestamp = str(datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    # Get list of text files
+    file_list = sorted(get_file_list_from_path(txt_dir, name='', extension='.txt'))
+    permutations = get_permutations(num_perm)
+
+    # Compute the signatures in parallel
+    file_paths = []
+    sizes = []
+    signatures = np.empty((len(file_list), num_perm), dtype=np.uint32)
+    with Pool(processes) as pool:
+        for file_path, size, signature in pool.imap(file_minhash, [(f, permutations) for f in file_list],
+                                                    chunksize=64):
+            if signature is not None:
+                signatures[len(file_paths)] = signature
+                file_paths.append(file_path)
+                sizes.append(size)
+    signatures = signatures[:len(file_paths)]
+
+    # Group the near-duplicates of the LSH buckets in clusters
+    clusters = get_lsh_clusters(signatures, bands, rows, threshold)
+
+    # Keep the longest document of each cluster
+    # and the files without signature
+    duplicates = set()
+    for cluster in clusters:
+        representative = max(cluster, key=lambda i: sizes[i])
+        duplicates.update(file_paths[i] for i in cluster if i != representative)
+    deduplicated_list = [file_path for file_path in file_list if file_path not in duplicates]
+
+    cluster_list = [[file_paths[i].split('/')[-1] for i in cluster] for cluster in clusters]
+
+    # Output clusters and deduplicated list
+    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    to_json_output_file(output_dir + 'near_duplicates_' + timestamp + '.json', cluster_list)
+    print_list_to_file(output_dir + 'deduplicated_' + timestamp + '.txt', deduplicated_list)
+
+    return cluster_list, deduplicated_list
+
+
+if __name__ == '__main__':
+
+    # Specify dir with the text files generated by get_text()
+    txt_dir = "data/text_files_20201214-165041/"
+
+    # Specify path for the output lists
+    output_dir = "id_logs/near_duplicates/"
+
+    # Find the near-duplicates
+    get_near_duplicates(txt_dir, output_dir, threshold=0.8)
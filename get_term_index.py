@@ -0,0 +1,414 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+    Program to build an on-disk inverted index of the terms
+    in the text files generated by get_text(),
+    to find passages (e.g., definitions such as "... means ...")
+    without searching through every text file.
+
+    The index is an SQLite database where each term has one posting
+    per document. A posting lists the (paragraph, position) of each
+    occurrence of the term in the document, delta-encoded as varints
+    and compressed with zlib when this makes it smaller.
+    Paragraphs are the blocks of text separated by an empty line.
+
+    The index is updated incrementally: only new or modified text files
+    are (re)indexed. Documents can also be indexed as they are extracted
+    by passing the records of iter_text() to update_index().
+
+    Usage:
+    index_text_files(txt_dir, index_path)
+    phrase_query(index_path, 'credit institution')
+    proximity_query(index_path, ['institution', 'means'], distance=3)
+
+    The queries return a list of (file name, paragraph number) tuples.
+"""
+
+import os
+import re
+import sqlite3
+import zlib
+from collections import defaultdict, deque
+from contextlib import closing
+from utils.file_utils import get_file_list_from_path
+
+TOKEN = re.compile(r'\w+')
+
+# Number of documents indexed in each transaction
+BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """
+    Get the lowercase word tokens of the given text
+    with their paragraph number and their position in the text.
+
+    :param text: str
+    :return: generator of tuple (str, int, int)
+    """
+    position = 0
+    for paragraph_number, paragraph in enumerate(text.split('\n\n')):
+        for token in TOKEN.findall(paragraph.lower()):
+            yield token, paragraph_number, position
+            position += 1
+
+
+def encode_positions(positions):
+    """
+    Encode the given list of (paragraph, position) tuples (in increasing order)
+    as delta-encoded varints, compressed with zlib if smaller.
+    The first byte tells whether the varints are compressed.
+
+    :param positions: list of tuple (int, int)
+    :return: bytes
+    """
+    data = bytearray()
+    previous_paragraph, previous_position = 0, 0
+    for paragraph, position in positions:
+        for value in (paragraph - previous_paragraph, position - previous_position):
+            while value > 0x7f:
+                data.append((value & 0x7f) | 0x80)
+                value >>= 7
+            data.append(value)
+        previous_paragraph, previous_position = paragraph, position
+
+    compressed = zlib.compress(bytes(data))
+    if len(compressed) < len(data):
+        return b'\x01' + compressed
+    return b'\x00' + bytes(data)
+
+
+def decode_positions(blob):
+    """
+    Decode the given posting blob (see encode_positions())
+    into a list of (paragraph, position) tuples.
+
+    :param blob: bytes
+    :return: list of tuple (int, int)
+    """
+    data = zlib.decompress(blob[1:]) if blob[0] == 1 else blob[1:]
+
+    values = []
+    value, shift = 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+
+    positions = []
+    paragraph, position = 0, 0
+    for i in range(0, len(values), 2):
+        paragraph += values[i]
+        position += values[i + 1]
+        positions.append((paragraph, position))
+
+    return positions
+
+
+def connect_index(index_path):
+    """
+    Open the index database in the given index_path, creating it if needed.
+
+    :param index_path: file path str
+    :return: sqlite3 Connection
+    """
+    if os.path.dirname(index_path):
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+    connection = sqlite3.connect(index_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS documents '
+                       '(doc_id INTEGER PRIMARY KEY, name TEXT UNIQUE, mtime REAL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS postings '
+                       '(term TEXT, doc_id INTEGER, positions BLOB, PRIMARY KEY (term, doc_id)) WITHOUT ROWID')
+    connection.execute('CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)')
+
+    return connection
+
+
+def index_document(connection, name, text, mtime=None):
+    """
+    Add the given text to the index under the given document name,
+    replacing the postings of any previous version of the document.
+
+    :param connection: sqlite3 Connection
+    :param name: str
+    :param text: str
+    :param mtime: float
+    :return: None
+    """
+    row = connection.execute('SELECT doc_id FROM documents WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        doc_id = connection.execute('INSERT INTO documents (name, mtime) VALUES (?, ?)', (name, mtime)).lastrowid
+    else:
+        doc_id = row[0]
+        connection.execute('UPDATE documents SET mtime = ? WHERE doc_id = ?', (mtime, doc_id))
+        connection.execute('DELETE FROM postings WHERE doc_id = ?', (doc_id,))
+
+    # Group the positions of each term
+    term_positions = defaultdict(list)
+    for token, paragraph, position in tokenize(text):
+        term_positions[token].append((paragraph, position))
+
+    connection.executemany('INSERT INTO postings (term, doc_id, positions) VALUES (?, ?, ?)',
+                           [(term, doc_id, encode_positions(positions))
+                            for term, positions in term_positions.items()])
+
+
+def update_index(index_path, documents):
+    """
+    Add the given documents to the index in the given index_path.
+    The documents are (name, text) tuples or the
+    (cellar_id, source_file, format, text) records of iter_text(),
+    in which case the name is the source file name without extension.
+    Documents are committed in batches of BATCH_SIZE.
+
+    :param index_path: file path str
+    :param documents: iterable of tuple
+    :return: int number of indexed documents
+    """
+    count = 0
+    with closing(connect_index(index_path)) as connection:
+        for document in documents:
+            if len(document) == 4:
+                name = os.path.splitext(document[1].split('/')[-1])[0]
+            else:
+                name = document[0]
+
+            index_document(connection, name, document[-1])
+
+            count += 1
+            if count % BATCH_SIZE == 0:
+                connection.commit()
+
+        connection.commit()
+
+    return count
+
+
+def index_text_files(txt_dir, index_path):
+    """
+    Index the text files in the given txt_dir
+    that are new or were modified since they were last indexed.
+
+    :param txt_dir: dir path str ending with "/"
+    :param index_path: file path str
+    :return: int number of indexed documents
+    """
+    count = 0
+    with closing(connect_index(index_path)) as connection:
+        indexed_mtimes = dict(connection.execute('SELECT name, mtime FROM documents'))
+
+        for file_path in get_file_list_from_path(txt_dir, name='', extension='.txt'):
+            name = file_path.split('/')[-1].replace('.txt', '')
+            mtime = os.path.getmtime(file_path)
+
+            # Skip documents already indexed
+            if indexed_mtimes.get(name) == mtime:
+                continue
+
+            # Documents indexed from the records of iter_text() have no mtime:
+            # record the mtime of their text file instead of indexing them again,
+            # so that later modifications of the file are detected
+            if name in indexed_mtimes and indexed_mtimes[name] is None:
+                connection.execute('UPDATE documents SET mtime = ? WHERE name = ?', (mtime, name))
+                continue
+
+            with open(file_path, 'r') as file:
+                index_document(connection, name, file.read(), mtime)
+
+            count += 1
+            if count % BATCH_SIZE == 0:
+                connection.commit()
+
+        connection.commit()
+
+    return count
+
+
+def select_in(connection, query, params, values, suffix=''):
+    """
+    Run the given query ending with "IN" for the given values
+    (followed by the given suffix, e.g., a GROUP BY clause),
+    in batches below the SQLite limit on the number of parameters.
+    Return the list of rows.
+
+    :param connection: sqlite3 Connection
+    :param query: str
+    :param params: tuple
+    :param values: iterable
+    :param suffix: str
+    :return: list of tuple
+    """
+    values = list(values)
+    rows = []
+    for start in range(0, len(values), 900):
+        batch = values[start:start + 900]
+        rows += connection.execute(query + ' (' + ','.join('?' * len(batch)) + ')' + suffix,
+                                   tuple(params) + tuple(batch))
+    return rows
+
+
+def get_postings(connection, term, doc_ids=None):
+    """
+    Get the decoded postings of the given term,
+    only in the given doc_ids if any.
+
+    :param connection: sqlite3 Connection
+    :param term: str
+    :param doc_ids: iterable of int
+    :return: dict of { int : list of tuple (int, int) }
+    """
+    if doc_ids is None:
+        rows = connection.execute('SELECT doc_id, positions FROM postings WHERE term = ?', (term,))
+    else:
+        rows = select_in(connection, 'SELECT doc_id, positions FROM postings WHERE term = ? AND doc_id IN',
+                         (term,), doc_ids)
+    return {doc_id: decode_positions(blob) for doc_id, blob in rows}
+
+
+def get_document_names(connection, doc_ids):
+    """
+    Get the names of the documents with the given doc_ids.
+
+    :param connection: sqlite3 Connection
+    :param doc_ids: iterable of int
+    :return: dict of { int : str }
+    """
+    return dict(select_in(connection, 'SELECT doc_id, name FROM documents WHERE doc_id IN', (), doc_ids))
+
+
+def get_term_postings(connection, terms):
+    """
+    Get the postings of each of the given terms, restricted to the documents
+    containing all the terms. Return None if a term is not in the index.
+    The documents containing all the terms are found first, starting from the rarest term,
+    without decoding any posting; only the postings of these documents are then decoded.
+
+    :param connection: sqlite3 Connection
+    :param terms: list of str
+    :return: list of dict of { int : list of tuple (int, int) } or None
+    """
+    unique_terms = list(dict.fromkeys(terms))
+
+    # Get the number of documents of each term
+    document_counts = dict(select_in(connection, 'SELECT term, COUNT(*) FROM postings WHERE term IN', (),
+                                     unique_terms, ' GROUP BY term'))
+    if len(document_counts) < len(unique_terms):
+        return None
+
+    # Intersect the documents of the terms, rarest term first
+    doc_ids = None
+    for term in sorted(unique_terms, key=lambda term: document_counts[term]):
+        if doc_ids is None:
+            rows = connection.execute('SELECT doc_id FROM postings WHERE term = ?', (term,))
+        else:
+            rows = select_in(connection, 'SELECT doc_id FROM postings WHERE term = ? AND doc_id IN', (term,), doc_ids)
+        doc_ids = {doc_id for doc_id, in rows}
+        if not doc_ids:
+            return None
+
+    # Decode the postings of the remaining documents only
+    postings = {term: get_postings(connection, term, doc_ids) for term in unique_terms}
+
+    return [postings[term] for term in terms]
+
+
+def phrase_query(index_path, phrase):
+    """
+    Find the paragraphs containing the given phrase (consecutive terms).
+    Return a sorted list of (document name, paragraph number) tuples.
+
+    :param index_path: file path str
+    :param phrase: str
+    :return: list of tuple (str, int)
+    """
+    terms = TOKEN.findall(phrase.lower())
+    if not terms:
+        return []
+
+    with closing(connect_index(index_path)) as connection:
+        term_postings = get_term_postings(connection, terms)
+        if term_postings is None:
+            return []
+
+        matches = set()
+        for doc_id, first_positions in term_postings[0].items():
+            following_positions = [set(postings[doc_id]) for postings in term_postings[1:]]
+            for paragraph, position in first_positions:
+                if all((paragraph, position + i + 1) in positions for i, positions in enumerate(following_positions)):
+                    matches.add((doc_id, paragraph))
+
+        names = get_document_names(connection, {doc_id for doc_id, paragraph in matches})
+
+    return sorted((names[doc_id], paragraph) for doc_id, paragraph in matches)
+
+
+def proximity_query(index_path, terms, distance=5):
+    """
+    Find the paragraphs where all the given terms occur, in any order,
+    within a window of the given distance (in number of words).
+    The terms are tokenized like the indexed texts (e.g., "Member State" gives two terms)
+    and a repeated term must occur as many times as it is repeated, at distinct positions.
+    Return a sorted list of (document name, paragraph number) tuples.
+
+    :param index_path: file path str
+    :param terms: list of str
+    :param distance: int
+    :return: list of tuple (str, int)
+    """
+    terms = [token for term in terms for token in TOKEN.findall(term.lower())]
+    if not terms:
+        return []
+
+    # Get the number of occurrences required for each term
+    term_counts = defaultdict(int)
+    for term in terms:
+        term_counts[term] += 1
+    unique_terms = list(term_counts)
+
+    with closing(connect_index(index_path)) as connection:
+        term_postings = get_term_postings(connection, unique_terms)
+        if term_postings is None:
+            return []
+
+        matches = set()
+        for doc_id in term_postings[0]:
+            # Merge the positions of all the terms, in text order
+            occurrences = sorted((position, paragraph, i)
+                                 for i, postings in enumerate(term_postings)
+                                 for paragraph, position in postings[doc_id])
+
+            # Slide a window over the occurrences of each paragraph,
+            # keeping the last occurrences of each term (as many as required)
+            last_seen = [deque(maxlen=term_counts[term]) for term in unique_terms]
+            for position, paragraph, i in occurrences:
+                last_seen[i].append((paragraph, position))
+                if all(len(seen) == seen.maxlen for seen in last_seen) and all(
+                        seen_paragraph == paragraph and position - seen_position <= distance
+                        for seen in last_seen for seen_paragraph, seen_position in seen):
+                    matches.add((doc_id, paragraph))
+
+        names = get_document_names(connection, {doc_id for doc_id, paragraph in matches})
+
+    return sorted((names[doc_id], paragraph) for doc_id, paragraph in matches)
+
+
+if __name__ == '__main__':
+
+    # Specify dir with the text files generated by get_text()
+    txt_dir = "data/text_files_20201214-165041/"
+
+    # Specify path of the index database
+    index_path = "data/term_index.sqlite"
+
+    # Index new and modified text files
+    index_text_files(txt_dir, index_path)
+
+    # Find definitional passages
+    # print(proximity_query(index_path, ['institution', 'means'], distance=3))
@@ -13,6 +13,21 @@
 
     Usage: get_text(input_path, output_dir, replace_existing=False)
 
+    To consume the text in-process as a stream of
+    (cellar_id, source_file, format, text) records,
+    use iter_text(input_path, output_dir=None, replace_existing=False, write_files=False).
+
+    To protect the run from malformed or huge files, set a time limit
+    (timeout, in seconds) and/or a memory limit (memory_limit, in bytes)
+    to extract each file in an isolated worker process, and a quarantine_path
+    to record the files that fail or exceed the limits, with the reason.
+    Quarantined files are skipped by later runs unless force=True.
+
+    Set fanout to store the text files of each CELLAR id under
+    fanout levels of fan-out directories named with the first characters
+    of the id (e.g., <output_dir>/39/ca/C_2020411EN.01050002.txt with fanout=2),
+    as the download directories (see get_id_path()).
+
     The input_path can be a dir name ending with "/"
     or a text file containing a list of file names.
     The output_dir name must also end with "/".
@@ -20,20 +35,27 @@
     XML files with ".doc." and ".toc." in their names are excluded
     as they only contain metadata.
 
+    Zip archives kept by download_zip(keep_zip=True) are read
+    directly: their XML and HTML members are extracted in memory
+    without unpacking the archive to disk.
+
      Note that:
      - Footnotes in XML files are currently deleted to avoid them being inserted in the middle of a sentence.
-     - The text from nested tables in HTML files is repeated.
+     - The text from nested tables in HTML files is inlined once in the cell containing them.
  """
 import os
 import sys
+import zipfile
 from tqdm import tqdm
-from utils.file_utils import get_file_list_from_path
-from utils.html2txt import html2txt_path_eu
-from utils.xml2txt import xml2txt_bs4_eu
+from utils.file_utils import get_file_list_from_path, get_zip_member_list, get_fanout_prefix
+from utils.doc2txt import doc2txt_bytes_eu, doc2txt_path_eu
+from utils.quarantine import ExtractionWorker, load_quarantine, quarantine_file
+from utils.output_writer import BatchedFileWriter
 
 sys.path.append("..")
 
-def get_text(input_path, output_dir, replace_existing=False):
+def get_text(input_path, output_dir, replace_existing=False, timeout=None, memory_limit=None, quarantine_path=None,
+             force=False, fanout=0):
     """
     Get the text from the XML and HTML files
     downloaded from the EU CELLAR server, clean it up,
@@ -42,15 +64,77 @@ def get_text(input_path, output_dir, replace_existing=False):
     or a text file containing a list of file names.
     The output_dir name must also end with "/".
     Exclude XML files with ".doc." and ".toc." in their names.
+    Zip archives (<CELLAR_ID>.zip) under the input_path are read
+    without being unpacked to disk.
 
      Note that:
      - Footnotes in XML files are currently removed to avoid them being inserted in the middle of a sentence.
-     - The text from nested tables in HTML files is repeated.
+     - The text from nested tables in HTML files is inlined once in the cell containing them.
+
+    Files are extracted in an isolated worker process if a timeout (s)
+    or a memory_limit (bytes) is given, and the files that fail are
+    recorded in the quarantine_path file, if any (see iter_text()).
+    The text files are stored under fanout levels of fan-out directories
+    named with the first characters of the CELLAR id, if fanout is greater than 0.
 
     :param input_path: dir path str ending with "/"
     :param output_dir: dir path str ending with "/"
+    :param replace_existing: bool
+    :param timeout: int
+    :param memory_limit: int
+    :param quarantine_path: file path str
+    :param force: bool
+    :param fanout: int
     :return:
     """
+    # Consume the text records, writing each one to its text file
+    for record in iter_text(input_path, output_dir, replace_existing=replace_existing, write_files=True,
+                            timeout=timeout, memory_limit=memory_limit, quarantine_path=quarantine_path,
+                            force=force, fanout=fanout):
+        pass
+
+
+def iter_text(input_path, output_dir=None, replace_existing=False, write_files=False, timeout=None,
+              memory_limit=None, quarantine_path=None, force=False, fanout=0):
+    """
+    Get the text from the XML and HTML files
+    downloaded from the EU CELLAR server, clean it up,
+    and yield a (cellar_id, source_file, format, text) record
+    as soon as each file is processed.
+    The source_file is the path of the XML or HTML file
+    (<zip_path>/<member_name> for zip archive members)
+    and the format is either "xml" or "html".
+
+    If an output_dir is given and replace_existing is False,
+    files whose text file already exists in output_dir are skipped.
+    For an input_path listing the files to process, only the text file path
+    of each listed file is checked, instead of listing all the text files of output_dir.
+    If write_files is True, the text of each record is also written
+    to a text file in output_dir, in batches of files written atomically
+    (all the files are written when the generator is exhausted or closed),
+    under fanout levels of fan-out directories named with the first characters
+    of the CELLAR id if fanout is greater than 0.
+
+    If a timeout (in seconds) or a memory_limit (in bytes) is given,
+    each file is extracted in an isolated worker process under these limits.
+    If a quarantine_path is given, the files whose extraction fails
+    or exceeds the limits are skipped and recorded in the quarantine_path file
+    with the reason, and the files already recorded there are skipped
+    unless force is True. Without a quarantine_path, errors are raised.
+
+    Usage: for cellar_id, source_file, format, text in iter_text(input_path): ...
+
+    :param input_path: dir path str ending with "/"
+    :param output_dir: dir path str ending with "/"
+    :param replace_existing: bool
+    :param write_files: bool
+    :param timeout: int
+    :param memory_limit: int
+    :param quarantine_path: file path str
+    :param force: bool
+    :param fanout: int
+    :return: generator of tuple (str, str, str, str)
+    """
     # Get list of files to process
     # print('INPUT_PATH:', input_path, input_path[-1])
     if input_path[-1] == '/':
@@ -60,82 +144,169 @@ def get_text(input_path, output_dir, replace_existing=False):
         html_file_list = get_file_list_from_path(input_path, name='', extension='.html')
         file_list = xml_file_list + html_file_list
 
+        # Get the XML and HTML members of the zip archives
+        # kept as single files under the given path
+        # Metadata members are excluded by name.
+        for zip_path in get_file_list_from_path(input_path, name='', extension='.zip'):
+            file_list += [(zip_path, member) for member in get_zip_member_list(zip_path)]
+
     else:
         # Get list of documents listed in the given file
         file_list = [line.rstrip('\n') for line in open(input_path)]
         # print('FILE_LIST:', file_list)
 
-    # Get list of existing text files
-    existing_txt_files_list = [f.split('/')[-1].replace('.txt','') for f in get_file_list_from_path(output_dir, name='', extension='.txt')]
-    # print('EXISTING_TXT_FILES:', existing_txt_files_list)
+    # Get set of existing text files.
+    # The text files of listed files are checked one by one below.
+    existing_txt_files_set = set()
+    check_existing_files = output_dir is not None and replace_existing == False and input_path[-1] != '/'
+    if output_dir is not None and replace_existing == False and not check_existing_files:
+        existing_txt_files_set = {f.split('/')[-1].replace('.txt','') for f in get_file_list_from_path(output_dir, name='', extension='.txt')}
+    # print('EXISTING_TXT_FILES:', existing_txt_files_set)
+
+    # Create output directory if it doesn't exist
+    # and buffer the text files to write them in batches
+    writer = None
+    if write_files:
+        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+        writer = BatchedFileWriter()
+
+    # Get the quarantined files to skip
+    quarantine = {}
+    if not force:
+        quarantine = load_quarantine(quarantine_path)
 
     # Display processed file and progress bar
     pbar = tqdm(total=len(file_list), desc='{desc}')
 
-    # Process XML and HTML files in file_list
-    for file_path in file_list:
+    # Keep the zip archive being read open for its next members
+    archive = None
 
-        # Display processed file
-        pbar.update(1)
+    # Extract files in an isolated worker process if limits are given
+    worker = None
+    if timeout is not None or memory_limit is not None:
+        worker = ExtractionWorker(timeout, memory_limit)
 
-        # Remove unwanted return character in folder names.
-        file_path = file_path.replace('\n', '')
+    try:
+        # Process XML and HTML files in file_list
+        # Zip archive members are (zip_path, member_name) tuples.
+        for file_path in file_list:
 
-        # Get full file name with extension
-        file = file_path.split('/')[-1]
+            # Display processed file
+            pbar.update(1)
 
-        # Get CELLAR id
-        cellar_id = file_path.split('/')[-2]
+            if isinstance(file_path, tuple):
+                zip_path, member = file_path
+                source_file = os.path.join(zip_path, member)
 
-        # Get extension
-        extension = file_path.split('.')[-1]
+                # Get full file name with extension
+                file = member.split('/')[-1]
 
-        # Get file name without extension
-        file_name = file.replace('.' + extension, '').strip()
+                # Get CELLAR id from the archive name
+                cellar_id = zip_path.split('/')[-1].replace('.zip', '')
 
-        # print('FILE_PATH:', file_path)
-        # print('EXTENSION:', extension)
-        # print('FILE:', file)
-        # print('FILE_NAME:', file_name)
-        # print('OUT_FILE:', out_file)
+            else:
+                zip_path, member = None, None
 
-        # Check whether text file already exists in output_dir
-        if replace_existing == False and file_name in existing_txt_files_list:
-            # print('FILE_EXISTS:', file_name, file_path)
-            pass
+                # Remove unwanted return character in folder names.
+                file_path = file_path.replace('\n', '')
+                source_file = file_path
 
-        else:
-            # Write text outputs of each XML and HTML file in a separate file
-            # named with the same file name as the original
-            # but with a .txt extension
-            # and located under the path specified by out_file.
-            # Exclude XML files with ".doc." and ".toc." in their names.
-            text = ''
+                # Get full file name with extension
+                file = file_path.split('/')[-1]
+
+                # Get CELLAR id
+                cellar_id = file_path.split('/')[-2]
 
-            # Get text from XML file
-            if extension == 'xml' and '.doc.' not in file_path and '.toc.' not in file_path:
-                pbar.set_description_str(f'Processing file: <XML> {cellar_id}/{file}', refresh=True)
-                text = xml2txt_bs4_eu(file_path)
+            # Get extension
+            extension = file.split('.')[-1]
 
-            # Get text from HTML file
-            elif extension == 'html':
-                pbar.set_description_str(f'Processing file: <HTML> {cellar_id}/{file}', refresh=True)
-                text = html2txt_path_eu(file_path)
+            # Get file name without extension
+            file_name = file.replace('.' + extension, '').strip()
+
+            # print('FILE_PATH:', file_path)
+            # print('EXTENSION:', extension)
+            # print('FILE:', file)
+            # print('FILE_NAME:', file_name)
+
+            # Check whether text file already exists in output_dir
+            if file_name in existing_txt_files_set:
+                # print('FILE_EXISTS:', file_name, file_path)
+                continue
+            if check_existing_files and os.path.exists(output_dir + get_fanout_prefix(cellar_id, fanout)
+                                                       + file_name + '.txt'):
+                continue
+
+            # Skip the files that failed in previous runs
+            if source_file in quarantine:
+                # print('QUARANTINED:', source_file, quarantine[source_file])
+                continue
+
+            # Get the text of each XML and HTML file.
+            # Exclude XML files with ".doc." and ".toc." in their names.
+            # Each file is read once as bytes and parsed once
+            # with the parser of its sniffed format.
+            if extension not in ('xml', 'html'):
+                continue
+            if extension == 'xml' and member is None and ('.doc.' in file_path or '.toc.' in file_path):
+                continue
+
+            pbar.set_description_str(f'Processing file: <{extension.upper()}> {cellar_id}/{file}', refresh=True)
+
+            try:
+                # Get text in the isolated worker process
+                if worker is not None:
+                    if member is not None:
+                        text = worker.extract(zip_path, member, extension)
+                    else:
+                        text = worker.extract(file_path, None, extension)
+
+                # Get text from zip archive member
+                elif member is not None:
+                    if archive is None or archive.filename != zip_path:
+                        if archive is not None:
+                            archive.close()
+                        archive = zipfile.ZipFile(zip_path)
+
+                    text = doc2txt_bytes_eu(archive.read(member), extension)
+
+                # Get text from XML or HTML file
+                else:
+                    text = doc2txt_path_eu(file_path)
+
+            except Exception as e:
+                if quarantine_path is None:
+                    raise
+                # Record the file in the quarantine list and skip it
+                quarantine_file(quarantine_path, source_file, type(e).__name__ + ': ' + str(e))
+                continue
 
             # print(text[:200])
 
-            # Output to file only if text was extracted from file
+            # Output only if text was extracted from file
             if len(text) > 0:
-                # Specify path for output text file
-                out_file_path = output_dir + file_name + '.txt'
 
-                # Create output directory if it doesn't exist
-                os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+                # Write the text in a separate file
+                # named with the same file name as the original
+                # but with a .txt extension
+                # and located under output_dir.
+                if write_files:
+                    # Specify path for output text file
+                    # under the fan-out directories of the CELLAR id, if any
+                    out_file_path = output_dir + get_fanout_prefix(cellar_id, fanout) + file_name + '.txt'
 
-                # Open output file for writing
-                with open(out_file_path, 'w+') as outfile:
                     # Write the text to the output file
-                    outfile.write(text)
+                    writer.write(out_file_path, text)
+
+                yield cellar_id, source_file, extension, text
+
+    finally:
+        if writer is not None:
+            writer.close()
+        if archive is not None:
+            archive.close()
+        if worker is not None:
+            worker.close()
+        pbar.close()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,489 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+    Program to harvest the EU CELLAR documents continuously.
+
+    Instead of running get_cellar_docs.py as a one-shot script,
+    the daemon keeps running and refreshes the harvest on a schedule:
+    every refresh_interval seconds, the SPARQL query is sent to the endpoint
+    (through the SPARQL cache), the ids that are not yet downloaded are
+    downloaded, the linked resources of link-only HTML files are resolved,
+    and the text of the new files is extracted.
+
+    Between refreshes, the daemon keeps its state in memory:
+    the set of downloaded ids (no re-walk of the download directory),
+    the SPARQL query (re-read only when its file changes),
+    and the pool of HTTP connections to the CELLAR server.
+    The state is saved under state_dir after each step,
+    so that a restarted daemon resumes where it stopped.
+    The files are downloaded to a single download directory
+    and text directory instead of new timestamped directories,
+    under two levels of fan-out directories by default (see get_id_path()).
+
+    The progress of the harvest is served as JSON
+    on http://127.0.0.1:<port>/health and http://127.0.0.1:<port>/progress.
+
+    On SIGTERM or SIGINT (Ctrl+C), the daemon stops gracefully:
+    the downloads and extractions in progress are finished,
+    the remaining ids are left for the next run, and the state is saved.
+
+    Usage: HarvestDaemon(query_path).run()
+"""
+
+import json
+import os
+import queue
+import signal
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from get_cellar_docs import download_id, get_downloaded_id_set, resolve_linked_docs
+from get_cellar_ids import get_cellar_info_from_endpoint, get_cellar_id_set_from_json_results, \
+    get_cellar_mtypes_from_json_results, get_cellar_worktypes_from_json_results, get_cellar_dates_from_json_results
+from get_text_from_cellar_files import iter_text
+from utils.download_planner import plan_downloads
+from utils.download_scheduler import estimate_download_sizes, get_downloaded_sizes, get_priority_ids, \
+    load_download_sizes, save_download_sizes, schedule_downloads
+from utils.file_utils import get_id_path, text_to_str
+from utils.id_set import CellarIdSet
+from utils.output_writer import write_file_atomic
+
+
+class HarvestDaemon:
+    """
+    Long-running harvest of the CELLAR documents returned by a SPARQL query,
+    with scheduled incremental refreshes, a local health/progress endpoint,
+    and graceful shutdown.
+    """
+
+    def __init__(self, query_path, dwnld_folder_path='data/cellar_files/', txt_folder_path='data/text_files/',
+                 state_dir='data/harvest_state/', refresh_interval=24 * 60 * 60, nthreads=11, port=8090,
+                 sparql_cache_dir='queries/sparql_query_cache/', partial_dir='data/partial_downloads/',
+                 plan_by_mtypes=True, timeout=300, memory_limit=4 * 1024 ** 3,
+                 quarantine_path='id_logs/quarantine.jsonl', fanout=2, download_sizes_path='id_logs/download_sizes.json',
+                 priority_since=None):
+        """
+        :param query_path: SPARQL query file path str
+        :param dwnld_folder_path: dir path str ending with "/"
+        :param txt_folder_path: dir path str ending with "/"
+        :param state_dir: dir path str ending with "/"
+        :param refresh_interval: int (s)
+        :param nthreads: int
+        :param port: int
+        :param sparql_cache_dir: dir path str ending with "/"
+        :param partial_dir: dir path str ending with "/"
+        :param plan_by_mtypes: bool
+        :param timeout: int (s)
+        :param memory_limit: int (bytes)
+        :param quarantine_path: file path str
+        :param fanout: int
+        :param download_sizes_path: file path str
+        :param priority_since: date str (e.g., '2020-01-01')
+        """
+        self.query_path = query_path
+        self.dwnld_folder_path = dwnld_folder_path
+        self.txt_folder_path = txt_folder_path
+        self.state_dir = state_dir
+        self.refresh_interval = refresh_interval
+        self.nthreads = nthreads
+        self.port = port
+        self.sparql_cache_dir = sparql_cache_dir
+        self.partial_dir = partial_dir
+        self.plan_by_mtypes = plan_by_mtypes
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.quarantine_path = quarantine_path
+        self.fanout = fanout
+        self.download_sizes_path = download_sizes_path
+        self.priority_since = priority_since
+
+        self.stop_event = Event()
+        self.lock = Lock()
+        self.server = None
+
+        # Query kept in memory with the modification time of its file
+        self.sparql_query = None
+        self.query_mtime = None
+
+        # Ids already downloaded, ids whose link-only HTML files are not yet resolved,
+        # and ids whose text is not yet extracted
+        self.downloaded_ids = CellarIdSet()
+        self.unlinked_ids = []
+        self.pending_ids = []
+
+        # Progress of the harvest served by the health endpoint
+        self.progress = {
+            'status': 'starting',
+            'phase': 'idle',
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'refreshes': 0,
+            'last_refresh_start': None,
+            'last_refresh_end': None,
+            'next_refresh': None,
+            'ids_in_query': 0,
+            'downloaded_ids': 0,
+            'queued': 0,
+            'downloaded': 0,
+            'failed': 0,
+            'linked': 0,
+            'pending_text': 0,
+            'extracted': 0,
+            'last_error': None,
+        }
+
+    def update_progress(self, **values):
+        """
+        Update the progress values served by the health endpoint.
+
+        :param values: dict
+        :return: None
+        """
+        with self.lock:
+            self.progress.update(values)
+
+    def get_progress(self):
+        """
+        Return a copy of the progress values.
+
+        :return: dict
+        """
+        with self.lock:
+            return dict(self.progress)
+
+    def load_state(self):
+        """
+        Load the state saved by a previous run, if any.
+        Without saved state, the set of downloaded ids is built once
+        from the subdirectories and zip archives of the download directory.
+
+        :return: None
+        """
+        ids_path = self.state_dir + 'downloaded_ids.bin'
+        if os.path.exists(ids_path):
+            self.downloaded_ids = CellarIdSet.load(ids_path)
+        elif os.path.exists(self.dwnld_folder_path):
+            self.downloaded_ids = get_downloaded_id_set(self.dwnld_folder_path, self.fanout)
+
+        state_path = self.state_dir + 'state.json'
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            self.unlinked_ids = state.get('unlinked_ids', [])
+            self.pending_ids = state.get('pending_ids', [])
+            self.update_progress(refreshes=state.get('refreshes', 0),
+                                 last_refresh_start=state.get('last_refresh_start'),
+                                 last_refresh_end=state.get('last_refresh_end'))
+
+        self.update_progress(downloaded_ids=len(self.downloaded_ids), pending_text=len(self.pending_ids))
+
+    def save_state(self):
+        """
+        Save the set of downloaded ids, the ids whose text is not yet extracted,
+        and the refresh information under state_dir.
+        Each file is written to a temporary file first and then renamed,
+        so that an interrupted save does not corrupt the previous state.
+
+        :return: None
+        """
+        os.makedirs(os.path.dirname(self.state_dir), exist_ok=True)
+
+        with self.lock:
+            downloaded_ids = self.downloaded_ids
+            state = {
+                'unlinked_ids': list(self.unlinked_ids),
+                'pending_ids': list(self.pending_ids),
+                'refreshes': self.progress['refreshes'],
+                'last_refresh_start': self.progress['last_refresh_start'],
+                'last_refresh_end': self.progress['last_refresh_end'],
+            }
+
+        ids_path = self.state_dir + 'downloaded_ids.bin'
+        downloaded_ids.save(ids_path + '.tmp')
+        os.replace(ids_path + '.tmp', ids_path)
+
+        state_path = self.state_dir + 'state.json'
+        write_file_atomic(state_path, json.dumps(state, indent=2))
+
+    def get_query(self):
+        """
+        Return the SPARQL query, reading the query file again only if it was modified.
+
+        :return: str
+        """
+        query_mtime = os.path.getmtime(self.query_path)
+        if self.sparql_query is None or query_mtime != self.query_mtime:
+            self.sparql_query = text_to_str(self.query_path)
+            self.query_mtime = query_mtime
+        return self.sparql_query
+
+    def download_worker(self, tasks, accept_headers, new_ids):
+        """
+        Download the ids in the tasks queue until it is empty
+        or the daemon is stopping.
+        Add the downloaded ids to the new_ids list.
+
+        :param tasks: queue.Queue of str
+        :param accept_headers: dict of { str : str }
+        :param new_ids: list of str
+        :return: None
+        """
+        while not self.stop_event.is_set():
+            try:
+                id = tasks.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                download_type = download_id(id, get_id_path(self.dwnld_folder_path, id, self.fanout),
+                                            self.partial_dir + id + '.zip.part', accept=accept_headers.get(id))
+            except Exception as e:
+                self.update_progress(last_error=id + ': ' + type(e).__name__ + ': ' + str(e))
+                download_type = None
+
+            with self.lock:
+                self.progress['queued'] -= 1
+                if download_type is None:
+                    self.progress['failed'] += 1
+                else:
+                    self.progress['downloaded'] += 1
+                    new_ids.append(id)
+
+    def download(self, id_list, accept_headers):
+        """
+        Download the ids in id_list with nthreads threads pulling from a shared queue.
+        Return the list of downloaded ids.
+
+        :param id_list: list of str
+        :param accept_headers: dict of { str : str }
+        :return: list of str
+        """
+        tasks = queue.Queue()
+        for id in id_list:
+            tasks.put(id)
+        self.update_progress(phase='download', queued=len(id_list), downloaded=0, failed=0)
+
+        new_ids = []
+        threads = [Thread(target=self.download_worker, args=(tasks, accept_headers, new_ids))
+                   for i in range(self.nthreads)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        return new_ids
+
+    def extract(self):
+        """
+        Extract the text of the files of the pending ids.
+        If the daemon is stopping, the extraction stops after the current file
+        and the ids are kept pending for the next run
+        (their text files already written are not extracted again).
+
+        :return: None
+        """
+        if len(self.pending_ids) == 0:
+            return
+        self.update_progress(phase='extract', extracted=0)
+
+        # List the files of the pending ids
+        file_list = []
+        for id in self.pending_ids:
+            id_dir = get_id_path(self.dwnld_folder_path, id, self.fanout) + '/'
+            if os.path.isdir(id_dir):
+                file_list += [id_dir + file for file in sorted(os.listdir(id_dir))]
+        file_list_path = self.state_dir + 'pending_files.txt'
+        write_file_atomic(file_list_path, ''.join(file + '\n' for file in file_list))
+
+        count_extracted = 0
+        for record in iter_text(file_list_path, self.txt_folder_path, write_files=True, timeout=self.timeout,
+                                memory_limit=self.memory_limit, quarantine_path=self.quarantine_path,
+                                fanout=self.fanout):
+            count_extracted += 1
+            self.update_progress(extracted=count_extracted)
+            if self.stop_event.is_set():
+                return
+
+        with self.lock:
+            self.pending_ids = []
+        self.update_progress(pending_text=0)
+
+    def link(self):
+        """
+        Download the contents linked by the link-only HTML files of the unlinked ids
+        and attach them to these ids (see resolve_linked_docs()).
+
+        :return: None
+        """
+        if len(self.unlinked_ids) == 0:
+            return
+        self.update_progress(phase='linked')
+
+        linked_ids = resolve_linked_docs(self.dwnld_folder_path, partial_dir=self.partial_dir,
+                                         nthreads=self.nthreads, ids=self.unlinked_ids, fanout=self.fanout)
+        self.update_progress(linked=len(linked_ids))
+
+        with self.lock:
+            self.unlinked_ids = []
+        self.save_state()
+
+    def refresh(self):
+        """
+        Run an incremental refresh of the harvest:
+        get the ids returned by the SPARQL query, download the ids not yet downloaded,
+        resolve the link-only HTML files of the new ids, and extract the text of the new files.
+        The state is saved after each step.
+
+        :return: None
+        """
+        self.update_progress(status='running', phase='query',
+                             last_refresh_start=datetime.now().isoformat(timespec='seconds'))
+
+        # Finish the link resolution and the extraction interrupted by the previous run, if any
+        self.link()
+        if self.stop_event.is_set():
+            return
+        self.extract()
+        if self.stop_event.is_set():
+            return
+
+        # Get the CELLAR ids from the SPARQL endpoint, through the SPARQL cache.
+        # Results cached by the previous refresh are queried again.
+        self.update_progress(phase='query')
+        sparql_query_results = get_cellar_info_from_endpoint(self.get_query(), self.sparql_cache_dir,
+                                                             ttl=self.refresh_interval // 2)
+        id_set = get_cellar_id_set_from_json_results(sparql_query_results)
+        missing_id_set = id_set - self.downloaded_ids
+        id_list = missing_id_set.to_list()
+        self.update_progress(ids_in_query=len(id_set))
+
+        accept_headers = {}
+        id_mtypes_dict = get_cellar_mtypes_from_json_results(sparql_query_results, missing_id_set)
+        if self.plan_by_mtypes:
+            id_list, accept_headers, skipped_ids = plan_downloads(id_list, id_mtypes_dict)
+
+        # Order the queue with the high-priority ids first and then the largest downloads first,
+        # so that the threads taking the next id from the queue finish at about the same time
+        id_worktypes_dict = get_cellar_worktypes_from_json_results(sparql_query_results)
+        expected_sizes = estimate_download_sizes(id_list, id_mtypes_dict, id_worktypes_dict,
+                                                 load_download_sizes(self.download_sizes_path))
+        id_dates_dict = get_cellar_dates_from_json_results(sparql_query_results, missing_id_set)
+        high_priority_ids = get_priority_ids(id_list, id_dates_dict, self.priority_since)
+        id_list = schedule_downloads(id_list, 1, expected_sizes, high_priority_ids)[0]
+
+        # Download the new ids
+        new_ids = self.download(id_list, accept_headers)
+        save_download_sizes(self.download_sizes_path, get_downloaded_sizes(self.dwnld_folder_path, new_ids,
+                                                                           self.fanout))
+        with self.lock:
+            self.downloaded_ids = self.downloaded_ids | CellarIdSet(new_ids)
+            self.unlinked_ids += new_ids
+            self.pending_ids += new_ids
+            self.progress['downloaded_ids'] = len(self.downloaded_ids)
+            self.progress['pending_text'] = len(self.pending_ids)
+        self.save_state()
+
+        # Download the contents linked by the new link-only HTML files,
+        # unless the daemon is stopping (the new ids are resolved by the next run)
+        if self.stop_event.is_set():
+            return
+        self.link()
+        if self.stop_event.is_set():
+            return
+
+        # Extract the text of the new files
+        self.extract()
+
+        with self.lock:
+            self.progress['refreshes'] += 1
+            self.progress['phase'] = 'idle'
+            self.progress['last_refresh_end'] = datetime.now().isoformat(timespec='seconds')
+        self.save_state()
+
+    def serve(self):
+        """
+        Serve the progress of the harvest as JSON on http://127.0.0.1:<port>/health
+        and http://127.0.0.1:<port>/progress in a background thread.
+
+        :return: None
+        """
+        daemon = self
+
+        class ProgressHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                progress = daemon.get_progress()
+                if self.path == '/health':
+                    body = {'status': progress['status'], 'phase': progress['phase']}
+                elif self.path == '/progress':
+                    body = progress
+                else:
+                    self.send_error(404)
+                    return
+
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), ProgressHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self, signum=None, frame=None):
+        """
+        Ask the daemon to stop gracefully (also used as a signal handler).
+
+        :return: None
+        """
+        self.update_progress(status='stopping')
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Run the refreshes every refresh_interval seconds until the daemon is stopped.
+
+        :return: None
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.load_state()
+        self.serve()
+
+        try:
+            while not self.stop_event.is_set():
+                start = time.time()
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep running, the next refresh retries
+                    self.update_progress(last_error=type(e).__name__ + ': ' + str(e))
+
+                if self.stop_event.is_set():
+                    break
+
+                next_refresh = start + self.refresh_interval
+                self.update_progress(status='waiting', phase='idle',
+                                     next_refresh=datetime.fromtimestamp(next_refresh).isoformat(timespec='seconds'))
+                self.stop_event.wait(max(0, next_refresh - time.time()))
+
+        finally:
+            self.save_state()
+            self.server.shutdown()
+            self.server.server_close()
+
+
+if __name__ == '__main__':
+
+    # Specify path of the SPARQL query
+    # The query file is read again by the next refresh when it is modified.
+    query_path = 'queries/sparql_queries/financial_domain_sparql_2019-01-07.rq'
+
+    # Run the harvest every 24 hours and serve its progress
+    # on http://127.0.0.1:8090/health and http://127.0.0.1:8090/progress
+    # Stop the daemon with Ctrl+C or SIGTERM.
+    HarvestDaemon(query_path, refresh_interval=24 * 60 * 60, port=8090).run()
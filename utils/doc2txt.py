@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Functions to extract the text from EU XML and HTML documents read as bytes.
+
+Each document is read once, its format and encoding are sniffed
+from its prologue, and it is parsed once with the parser
+of the corresponding extractor (html2txt_soup_eu() or xml2txt_soup_eu()).
+"""
+
+import codecs
+import re
+from bs4 import BeautifulSoup
+from utils.html2txt import html2txt_soup_eu
+from utils.xml2txt import xml2txt_soup_eu
+
+
+# Number of bytes at the start of a document
+# in which to look for the XML declaration, the Doctype and the charset
+PROLOGUE_SIZE = 2048
+
+XML_ENCODING = re.compile(rb'^\s*<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)["\']')
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9._-]+)', flags=re.IGNORECASE)
+HTML_DOCTYPE = re.compile(rb'<!DOCTYPE\s+html', flags=re.IGNORECASE)
+
+
+def sniff_doc(data, extension):
+    """
+    Get the format ("xml" or "html") and the encoding of the given document bytes
+    from its prologue and the given file extension.
+    XML documents with an HTML Doctype declaration are HTML documents.
+    The encoding is taken from the byte order mark, the XML declaration
+    or the HTML charset, and defaults to UTF-8.
+
+    :param data: bytes
+    :param extension: str
+    :return: tuple (str, str)
+    """
+    prologue = data[:PROLOGUE_SIZE]
+
+    # Get format
+    if extension == 'html' or HTML_DOCTYPE.search(prologue):
+        doc_format = 'html'
+    else:
+        doc_format = 'xml'
+
+    # Get encoding
+    if prologue.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8'
+    elif prologue.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    else:
+        encoding_match = XML_ENCODING.search(prologue) or META_CHARSET.search(prologue)
+        encoding = encoding_match.group(1).decode('ascii').lower() if encoding_match else 'utf-8'
+
+    return doc_format, encoding
+
+
+def doc2txt_bytes_eu(data, extension):
+    """
+    Get text string from the given bytes of an EU XML or HTML document
+    with the given file extension ("xml" or "html").
+    The document is parsed once, with the parser of its sniffed format.
+
+    :param data: bytes
+    :param extension: str
+    :return: str
+    """
+    doc_format, encoding = sniff_doc(data, extension)
+
+    if doc_format == 'html':
+        return html2txt_soup_eu(BeautifulSoup(data, features="lxml", from_encoding=encoding))
+    else:
+        return xml2txt_soup_eu(BeautifulSoup(data, "lxml-xml", from_encoding=encoding))
+
+
+def doc2txt_path_eu(file_path):
+    """
+    Get text string from the EU XML or HTML file in the given file_path,
+    read once as bytes.
+
+    :param file_path: str
+    :return: str
+    """
+    with open(file_path, 'rb') as file:
+        return doc2txt_bytes_eu(file.read(), file_path.split('.')[-1])
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Functions to plan the GET requests sent to the EU CELLAR endpoint
+using the manifestation types (mtypes) returned by the SPARQL query.
+
+For each CELLAR id, the cheapest manifestation type from which
+the text can be extracted is requested with its own Accept header,
+instead of a single broad Accept header for every id.
+CELLAR ids without any such manifestation type are not requested.
+"""
+
+import sys
+sys.path.append("..")
+
+
+# Manifestation types from which get_text() extracts text well,
+# in order of preference (cheapest first), with the Accept header
+# to send for each type and its relative expected size.
+# Plain text (txt) manifestations are left out
+# as get_text() only processes XML and HTML files.
+MANIFESTATION_TYPES = [
+    ('xhtml', 'application/xhtml+xml', 1.0),
+    ('html', 'text/html', 1.2),
+    ('xhtml_simpl', 'application/xhtml+xml;type=simplified', 1.3),
+    ('html_simpl', 'text/html;type=simplified', 1.4),
+    ('xml', 'application/zip;mtype=fmx4, application/xml;mtype=fmx4', 2.0),
+]
+
+
+def get_manifestation_plan(mtypes):
+    """
+    Get the Accept header and the relative expected size
+    of the preferred manifestation type among the given mtypes.
+    Return None if none of the mtypes can be extracted.
+
+    :param mtypes: list of str
+    :return: tuple (str, float) or None
+    """
+    for mtype, accept, expected_size in MANIFESTATION_TYPES:
+        if mtype in mtypes:
+            return accept, expected_size
+
+    return None
+
+
+def plan_downloads(id_list, id_mtypes_dict):
+    """
+    Plan the downloads of the given id_list using the manifestation types
+    of each id in the given id_mtypes_dict (as returned by
+    get_cellar_mtypes_from_json_results() or get_cellar_mtypes_from_csv_file()).
+
+    Return:
+    - the list of ids to download, in the order of id_list
+      (the downloads are ordered by schedule_downloads(), see download_scheduler.py),
+    - a dictionary where key=id, value=Accept header to send for the id,
+    - the list of ids skipped because they have no extractable manifestation type.
+
+    Ids missing from id_mtypes_dict are kept and get no specific Accept header,
+    so that rest_get_call() falls back to its default Accept header.
+
+    :param id_list: list of str
+    :param id_mtypes_dict: dict of { str : list of str }
+    :return: tuple (list of str, dict of { str : str }, list of str)
+    """
+    planned_ids = []
+    accept_headers = {}
+    skipped_ids = []
+
+    for cellar_id in id_list:
+
+        # Keep ids without known manifestation types
+        if cellar_id not in id_mtypes_dict:
+            planned_ids.append(cellar_id)
+            continue
+
+        plan = get_manifestation_plan(id_mtypes_dict[cellar_id])
+
+        # Skip ids without textual manifestation
+        if plan is None:
+            skipped_ids.append(cellar_id)
+        else:
+            accept_headers[cellar_id] = plan[0]
+            planned_ids.append(cellar_id)
+
+    return planned_ids, accept_headers, skipped_ids
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Functions to schedule the GET requests sent to the EU CELLAR endpoint
+across the download threads.
+
+The size of each download is estimated from the available signals,
+in order of reliability:
+- the size returned by a HEAD request (Content-Length), if probed,
+- the size of the files downloaded for the id by earlier runs,
+- the median size of the earlier downloads of the same work type
+  (e.g., regulation, directive), scaled by the relative expected size
+  of the manifestation type to request (see download_planner.py),
+- a default size, scaled in the same way.
+
+The ids are then assigned to the threads with the longest processing time
+first (LPT) rule: the largest downloads are assigned first, each one to the
+thread with the smallest expected load, so that the large downloads
+(e.g., consolidated acts) are spread across the threads and do not stretch
+the end of the run. High-priority ids (e.g., recent documents)
+are scheduled before all the other ids of every thread.
+"""
+
+import json
+import heapq
+import os
+import statistics
+import sys
+from utils.download_planner import get_manifestation_plan
+from utils.file_utils import get_id_path
+
+sys.path.append("..")
+
+
+# Expected size (bytes) of a download without any size information
+DEFAULT_SIZE = 200 * 1024
+
+
+def load_download_sizes(sizes_path):
+    """
+    Load the sizes of the files downloaded by earlier runs
+    from the given sizes_path JSON file, if it exists.
+    Return a dictionary where key=CELLAR id, value=size in bytes.
+
+    :param sizes_path: file path str
+    :return: dict of { str : int }
+    """
+    if sizes_path is None or not os.path.exists(sizes_path):
+        return {}
+
+    with open(sizes_path, 'r') as f:
+        return json.load(f)
+
+
+def save_download_sizes(sizes_path, sizes):
+    """
+    Add the given sizes to the sizes already saved in the sizes_path JSON file.
+    The file is written to a temporary file first and then renamed.
+
+    :param sizes_path: file path str
+    :param sizes: dict of { str : int }
+    :return: None
+    """
+    all_sizes = load_download_sizes(sizes_path)
+    all_sizes.update(sizes)
+
+    os.makedirs(os.path.dirname(sizes_path), exist_ok=True)
+    with open(sizes_path + '.tmp', 'w') as f:
+        json.dump(all_sizes, f)
+    os.replace(sizes_path + '.tmp', sizes_path)
+
+
+def get_downloaded_sizes(folder_path, id_list, fanout=0):
+    """
+    Get the total size of the files downloaded for each id of the given id_list
+    under the given folder_path, i.e., the size of the <id>/ directory
+    or of the <id>.zip archive (see process_range()).
+    Ids without downloaded files are left out.
+
+    :param folder_path: dir path str ending with "/"
+    :param id_list: list of str
+    :param fanout: int
+    :return: dict of { str : int }
+    """
+    sizes = {}
+    for cellar_id in id_list:
+        id_path = get_id_path(folder_path, cellar_id, fanout)
+
+        if os.path.isdir(id_path):
+            sizes[cellar_id] = sum(os.path.getsize(os.path.join(dirpath, file))
+                                   for dirpath, dirs, files in os.walk(id_path) for file in files)
+        elif os.path.exists(id_path + '.zip'):
+            sizes[cellar_id] = os.path.getsize(id_path + '.zip')
+
+    return sizes
+
+
+def estimate_download_sizes(id_list, id_mtypes_dict=None, id_worktypes_dict=None, past_sizes=None,
+                            probed_sizes=None):
+    """
+    Estimate the size (bytes) of the download of each id of the given id_list
+    from the probed sizes, the past sizes, the work types and the manifestation types
+    of the ids (see the module description).
+
+    :param id_list: list of str
+    :param id_mtypes_dict: dict of { str : list of str }
+    :param id_worktypes_dict: dict of { str : list of str }
+    :param past_sizes: dict of { str : int }
+    :param probed_sizes: dict of { str : int }
+    :return: dict of { str : float }
+    """
+    id_mtypes_dict = id_mtypes_dict or {}
+    id_worktypes_dict = id_worktypes_dict or {}
+    past_sizes = past_sizes or {}
+    probed_sizes = probed_sizes or {}
+
+    # Get the median past size of each work type
+    worktype_sizes = {}
+    for cellar_id, size in past_sizes.items():
+        for worktype in id_worktypes_dict.get(cellar_id, []):
+            worktype_sizes.setdefault(worktype, []).append(size)
+    worktype_medians = {worktype: statistics.median(sizes) for worktype, sizes in worktype_sizes.items()}
+
+    expected_sizes = {}
+    for cellar_id in id_list:
+        if cellar_id in probed_sizes:
+            expected_sizes[cellar_id] = probed_sizes[cellar_id]
+            continue
+
+        if cellar_id in past_sizes:
+            expected_sizes[cellar_id] = past_sizes[cellar_id]
+            continue
+
+        # Scale the typical size of the work type by the manifestation type to request
+        plan = get_manifestation_plan(id_mtypes_dict.get(cellar_id, []))
+        size_factor = plan[1] if plan is not None else 1.0
+        medians = [worktype_medians[worktype] for worktype in id_worktypes_dict.get(cellar_id, [])
+                   if worktype in worktype_medians]
+        typical_size = max(medians) if medians else DEFAULT_SIZE
+        expected_sizes[cellar_id] = typical_size * size_factor
+
+    return expected_sizes
+
+
+def get_priority_ids(id_list, id_dates_dict=None, since=None, id_worktypes_dict=None, work_types=None,
+                     priority_ids=None):
+    """
+    Get the high-priority ids of the given id_list, i.e., the ids
+    - dated since the given since date str (e.g., '2020-01-01'), if any,
+    - or of one of the given work_types (e.g., ['http://publications.europa.eu/ontology/cdm#regulation']), if any,
+    - or in the given priority_ids list, if any.
+    Dates are compared as ISO 8601 strs and the latest date of each id is used.
+
+    :param id_list: list of str
+    :param id_dates_dict: dict of { str : list of str }
+    :param since: str
+    :param id_worktypes_dict: dict of { str : list of str }
+    :param work_types: list of str
+    :param priority_ids: list of str
+    :return: set of str
+    """
+    id_dates_dict = id_dates_dict or {}
+    id_worktypes_dict = id_worktypes_dict or {}
+    work_types = set(work_types or [])
+    priority_ids = set(priority_ids or [])
+
+    high_priority_ids = set()
+    for cellar_id in id_list:
+        dates = id_dates_dict.get(cellar_id, [])
+        if (cellar_id in priority_ids
+                or (since is not None and len(dates) != 0 and max(dates) >= since)
+                or not work_types.isdisjoint(id_worktypes_dict.get(cellar_id, []))):
+            high_priority_ids.add(cellar_id)
+
+    return high_priority_ids
+
+
+def schedule_downloads(download_list, nworkers, expected_sizes, priority_ids=()):
+    """
+    Assign the downloads of the given download_list to nworkers threads
+    with the longest processing time first rule, using the expected size of each download.
+    The high-priority downloads (whose id is in priority_ids) are scheduled first,
+    and then the other downloads, taking into account the load already assigned
+    to each thread.
+    The download_list can contain ids or (id, language) tuples (see process_range()).
+    Return the list of downloads of each thread.
+
+    Usage: sub_lists = schedule_downloads(download_list, nthreads, expected_sizes)
+    and start a thread with process_range(sub_lists[i], ...) for each i.
+    With nworkers=1, the single list gives the order in which the downloads should be
+    taken from a queue shared by the threads.
+
+    :param download_list: list of str or of tuple (str, str)
+    :param nworkers: int
+    :param expected_sizes: dict of { str : float }
+    :param priority_ids: set of str
+    :return: list of lists of str or of tuple (str, str)
+    """
+    def get_id(download):
+        return download[0] if isinstance(download, tuple) else download
+
+    def get_size(download):
+        return expected_sizes.get(get_id(download), DEFAULT_SIZE)
+
+    high_priority = [download for download in download_list if get_id(download) in priority_ids]
+    low_priority = [download for download in download_list if get_id(download) not in priority_ids]
+
+    # Keep the expected load of each thread in a heap
+    worker_lists = [[] for i in range(nworkers)]
+    loads = [(0, i) for i in range(nworkers)]
+
+    for downloads in (high_priority, low_priority):
+        # Largest downloads first, in the order of the download_list for equal sizes
+        for download in sorted(downloads, key=get_size, reverse=True):
+            load, i = heapq.heappop(loads)
+            worker_lists[i].append(download)
+            heapq.heappush(loads, (load + get_size(download), i))
+
+    return worker_lists
@@ -5,8 +5,10 @@ import json
 import os
 import random
 import shutil
+import zipfile
 from collections import defaultdict
 import spacy
+from utils.output_writer import write_file_atomic
 
 
 def get_file_list_from_path(path, name='', extension='.txt'):
@@ -47,6 +49,91 @@ def get_subdir_list_from_path(dirpath):
     return subdir_list
 
 
+def get_zip_id_list_from_path(dirpath):
+    """
+    Get the names of the zip archives in the given path
+    without their ".zip" extension, i.e., the CELLAR ids
+    of the archives kept by download_zip(keep_zip=True).
+    Return a list of CELLAR ids.
+
+    :param dirpath: str
+    :return: list
+    """
+    zip_id_list = [f.name[:-len('.zip')] for f in os.scandir(dirpath) if f.is_file() and f.name.endswith('.zip')]
+    # print('ZIP_ID_LIST:', len(zip_id_list), zip_id_list[:10])
+    return zip_id_list
+
+
+def get_fanout_prefix(cellar_id, fanout=0, width=2):
+    """
+    Get the fan-out subdirectories of the given CELLAR id,
+    i.e., fanout levels of directories named with the next width characters of the id
+    (e.g., "39/ca/" for 39ca1c1c-3091-11eb-b27b-01aa75ed71a1 with fanout=2).
+    The leading hex digits of CELLAR ids are uniformly distributed,
+    both for version-1 (time-based) UUIDs, which start with the fastest-changing
+    time_low field, and for version-4 (random) UUIDs, which make up most of the ids,
+    so that the ids are spread evenly across the fan-out directories.
+    Return an empty str if fanout is 0 (flat layout).
+
+    :param cellar_id: str
+    :param fanout: int
+    :param width: int
+    :return: str
+    """
+    return ''.join(cellar_id[level * width:(level + 1) * width] + '/' for level in range(fanout))
+
+
+def get_id_path(dirpath, cellar_id, fanout=0):
+    """
+    Get the path of the given CELLAR id under the given dirpath
+    with fanout levels of fan-out directories, without scanning any directory
+    (e.g., data/cellar_files/39/ca/39ca1c1c-3091-11eb-b27b-01aa75ed71a1 with fanout=2).
+    Add '/' to get the path of a directory or '.zip' to get the path of a zip archive.
+
+    :param dirpath: dir path str ending with "/"
+    :param cellar_id: str
+    :param fanout: int
+    :return: str
+    """
+    return dirpath + get_fanout_prefix(cellar_id, fanout) + cellar_id
+
+
+def get_fanout_dir_list(dirpath, fanout=0, width=2):
+    """
+    Get the paths of the last level of fan-out directories under the given dirpath,
+    i.e., the directories containing the CELLAR id directories and zip archives.
+    Return [dirpath] if fanout is 0 (flat layout).
+
+    :param dirpath: dir path str ending with "/"
+    :param fanout: int
+    :param width: int
+    :return: list of dir path str ending with "/"
+    """
+    dir_list = [dirpath]
+    for level in range(fanout):
+        dir_list = [f.path + '/' for d in dir_list for f in os.scandir(d) if f.is_dir() and len(f.name) == width]
+    return dir_list
+
+
+def get_zip_member_list(zip_path, extensions=('.xml', '.html'), exclude=('.doc.', '.toc.')):
+    """
+    Get the names of the members of the zip archive in the given zip_path
+    that end with one of the given extensions.
+    Members with one of the exclude strs in their names
+    (e.g., metadata files) are skipped without being read.
+    Return a list of member names.
+
+    :param zip_path: str
+    :param extensions: tuple of str
+    :param exclude: tuple of str
+    :return: list of str
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        member_list = [name for name in archive.namelist()
+                       if name.endswith(extensions) and not any(string in name for string in exclude)]
+    return member_list
+
+
 def file_lines_to_list(file_path):
     """
     Get text of file in the given file_path,
@@ -175,7 +262,7 @@ def remove_existing_file_names(file_list, dir_path):
     # print('INPUT:', file_list[:10])
     
     # Get names with whole path of the already existing files
-    existing_files_dict = defaultdict()
+    existing_files_set = set()
     existing_files_list = get_file_list_from_path(dir_path, name='', extension='')
     # print('EXISTING:', existing_files_list[:10])
 
@@ -189,7 +276,7 @@ def remove_existing_file_names(file_list, dir_path):
         if file_id == '.DS_Store':
             pass
         else:
-            existing_files_dict[file_id] = 0
+            existing_files_set.add(file_id)
 
     # Check whether each file name
     # in the given file_list
@@ -200,12 +287,12 @@ def remove_existing_file_names(file_list, dir_path):
     for file_name in file_list:
 
         # Get the file name from full path
-        if file_name.split('/')[-1] in existing_files_dict:
+        if file_name.split('/')[-1] in existing_files_set:
             pass
         else:
             non_existing_files_list.append(file_name)
 
-    # print('LEN file_list/non_existing_files_list/existing_files_dict:', len(file_list), '/', len(non_existing_files_list), '/', len(existing_files_dict), len(non_existing_files_list)+len(existing_files_dict))
+    # print('LEN file_list/non_existing_files_list/existing_files_dict:', len(file_list), '/', len(non_existing_files_list), '/', len(existing_files_set), len(non_existing_files_list)+len(existing_files_set))
 
     return non_existing_files_list
 
@@ -237,16 +324,11 @@ def print_list_to_file(outfile_name, list):
     and print each element in the given list
     on a new line of the new file.
     Last line not followed by newline.
+    The file is written atomically with a single write call.
 
     :param outfile_name: str
     :param list: list
     :return: None
     """
-    with open(outfile_name, 'w') as outfile:
-        for elt in list[:-1]:
-            outfile.write('{name}{newline}'.format(name=elt, newline='\n'))
-            # outfile.write("%s\n" % file_name)
-
-        # Last line not followed by newline
-        for file_name in list[-1]:
-            outfile.write(file_name)
+    # Last line not followed by newline
+    write_file_atomic(outfile_name, '\n'.join(str(elt) for elt in list))
@@ -4,7 +4,7 @@
 """ Functions to extract the text from HTML documents or strings. """
 
 import re
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
 import sys
 sys.path.append("..")
 
@@ -45,51 +45,83 @@ def html2txt_path(file_path):
 def html2txt_path_eu(file_path):
     """
     Get text string from the HTML file in the given file_path of EU file.
+    To read the file as bytes and sniff its encoding,
+    use doc2txt_path_eu() in utils/doc2txt.py.
 
     :param file_path: str
     :return: str
     """
 
     with open(file_path, 'r') as file:
-        text = ' '.join(file.readlines())
-        output_text = html2txt_str_eu(text)
+        output_text = html2txt_str_eu(file.read())
 
         return output_text
 
 
-def html2txt_str_eu(string):
+def html2txt_str_eu(string, nested_tables='inline'):
     """
     Get text string from the given string with HTML tags from EU docs.
     Clean up and return the text str of the document where each <p> tag
     is on a new line.
+    Each table is linearized once (see linearize_table()).
+    The text of nested tables is either inlined in the cell containing them
+    (nested_tables='inline') or output as a separate block after the table
+    (nested_tables='block').
 
     :param string: str
+    :param nested_tables: str
     :return: str
     """
     # Get text str from html str
     html_str = BeautifulSoup(string, features="lxml")
 
+    return html2txt_soup_eu(html_str, nested_tables)
+
+
+def html2txt_soup_eu(html_str, nested_tables='inline'):
+    """
+    Get text string from the given parsed HTML document (BeautifulSoup) from EU docs.
+    See html2txt_str_eu().
+
+    :param html_str: BeautifulSoup
+    :param nested_tables: str
+    :return: str
+    """
     raw_str_list = []
-    for tag in html_str.html.find_all():
+
+    # Visit the tags in document order without descending into tables,
+    # so that each tag is visited only once
+    tags = list(reversed(html_str.html.contents))
+    while tags:
+        tag = tags.pop()
+
+        if not isinstance(tag, Tag):
+            continue
 
         # Get text from tables
         if tag.name == 'table':
-            # Get text for each row and append it to a list
-            raw_str_list.append(table2txt(tag))
+            # Get text of the table and of its nested tables, if output as blocks
+            raw_str_list += linearize_table(tag, nested_tables)
 
         # Get text from tags outside tables
-        # If tag is p and p is not in a table and has no other p descendents
-        elif tag.name == 'p' and 'table' not in [tab.name for tab in tag.parents] and tag.p == None:
+        # If tag is p and has no other p descendents
+        elif tag.name == 'p' and tag.p == None:
             # print('TAG_P_is_None:', tag.p == None)
             raw_str_list.append(tag.get_text(separator=" "))
             # print('P_TXT:', tag.get_text(separator=" "))
+
+        # Else, visit the children of the tag
+        else:
+            tags.extend(reversed(tag.contents))
     # print('RAW_STR_LIST:', raw_str_list)
 
     # Clean up strings in list
     clean_str_list = []
     for raw_str in raw_str_list:
 
-        clean_str = clean_up_str(raw_str)
+        # Follow each line break of the source with a space
+        # so that the lines of a paragraph are joined by clean_up_str()
+        clean_str = clean_up_str(raw_str.replace('\n', '\n '))
 
         # Add clean str to new list
         clean_str_list.append(clean_str)
@@ -106,25 +138,109 @@ def html2txt_str_eu(string):
 
 def table2txt(table):
     """
-    Get the text in the <p> tags of the rows of the given table.
+    Get the text in the cells of the rows of the given table.
     Join the extracted text with a space to reconstruct the row.
+    The text of nested tables is inlined in the cell containing them.
     Return the new row str.
 
-    :param table: str
+    :param table: bs4 Tag
     :return: str
     """
-    output_rows_list = []
+    return ' '.join(linearize_table(table, nested_tables='inline'))
 
-    for table_row in table.find_all('tr'):
-        columns = table_row.find_all('td', recursive=False)
 
-        for column in columns:
-            output_rows_list.append(column.find_next("p").text.strip())
-
-    text_str = ' '.join(output_rows_list)
+def linearize_table(table, nested_tables='inline'):
+    """
+    Get the text of the cells of the given table, visiting each cell once.
+    The text of the cells is joined with a space.
+    Nested tables are either inlined in the cell containing them
+    (nested_tables='inline') or output as separate blocks
+    following the text of the table (nested_tables='block').
+    Return a list of text str, starting with the text of the given table.
+
+    :param table: bs4 Tag
+    :param nested_tables: str
+    :return: list of str
+    """
+    nested_blocks = []
+    text_str = table_text(table, nested_tables, nested_blocks)
     # print('DATA:', text_str)
 
-    return text_str
+    return [text_str] + nested_blocks
+
+
+def table_text(table, nested_tables, nested_blocks):
+    """
+    Get the text of the cells of the rows of the given table
+    (excluding the rows of nested tables) and join it with a space.
+    Nested tables output as blocks are added to the nested_blocks list.
+
+    :param table: bs4 Tag
+    :param nested_tables: str
+    :param nested_blocks: list of str
+    :return: str
+    """
+    output_cells_list = []
+
+    for table_row in table_rows(table):
+        for column in table_row.find_all('td', recursive=False):
+            cell_str = cell_text(column, nested_tables, nested_blocks)
+            if cell_str:
+                output_cells_list.append(cell_str)
+
+    return ' '.join(output_cells_list)
+
+
+def table_rows(table):
+    """
+    Get the rows of the given table,
+    whether or not they are grouped under thead, tbody or tfoot tags.
+    Rows of nested tables are excluded.
+
+    :param table: bs4 Tag
+    :return: generator of bs4 Tag
+    """
+    for child in table.children:
+        if isinstance(child, Tag):
+            if child.name == 'tr':
+                yield child
+            elif child.name in ('thead', 'tbody', 'tfoot'):
+                for row in child.find_all('tr', recursive=False):
+                    yield row
+
+
+def cell_text(cell, nested_tables, nested_blocks):
+    """
+    Get the text of the given table cell, whether or not it is in <p> tags.
+    Each string of the cell is visited once.
+    Nested tables are inlined or added to the nested_blocks list
+    depending on nested_tables ('inline' or 'block').
+
+    :param cell: bs4 Tag
+    :param nested_tables: str
+    :param nested_blocks: list of str
+    :return: str
+    """
+    cell_str_list = []
+
+    nodes = list(reversed(cell.contents))
+    while nodes:
+        node = nodes.pop()
+
+        if isinstance(node, Tag):
+            if node.name == 'table':
+                nested_str = table_text(node, nested_tables, nested_blocks)
+                if nested_tables == 'block':
+                    nested_blocks.append(nested_str)
+                else:
+                    cell_str_list.append(nested_str)
+            else:
+                nodes.extend(reversed(node.contents))
+
+        elif isinstance(node, NavigableString) and not isinstance(node, Comment):
+            cell_str_list.append(node)
+
+    return ' '.join(cell_str_list).strip()
 
 
 def clean_up_str(raw_str):
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Compact set of CELLAR ids.
+
+CELLAR ids that are UUIDs (e.g., 39ca1c1c-3091-11eb-b27b-01aa75ed71a1)
+are stored as 16-byte packed values in a sorted numpy array
+instead of Python str objects, so that large id lists use a fraction
+of the memory and set operations run on sorted arrays.
+Any other id is kept as a str.
+
+Usage:
+new_ids = CellarIdSet(id_list) - CellarIdSet(downloaded_files_list)
+new_ids.save(file_path)
+new_ids = CellarIdSet.load(file_path)
+"""
+
+import uuid
+import numpy as np
+
+# Header of the files written by CellarIdSet.save()
+ID_SET_MAGIC = b'CELLARIDS1\n'
+
+
+def pack_cellar_id(cellar_id):
+    """
+    Get the 16 bytes of the given CELLAR id
+    if it is a UUID in canonical form, else None.
+
+    :param cellar_id: str
+    :return: bytes or None
+    """
+    try:
+        packed = uuid.UUID(cellar_id)
+    except ValueError:
+        return None
+
+    # Keep ids that would not be restored as the same str
+    if str(packed) != cellar_id:
+        return None
+
+    return packed.bytes
+
+
+def unpack_cellar_id(packed):
+    """
+    Get the CELLAR id str of the given 16 bytes.
+    Trailing null bytes dropped by numpy are restored.
+
+    :param packed: bytes
+    :return: str
+    """
+    return str(uuid.UUID(bytes=packed.ljust(16, b'\0')))
+
+
+class CellarIdSet:
+    """
+    Set of CELLAR ids where UUIDs are stored as a sorted array of 16-byte values.
+    Supports len(), membership tests, iteration (in sorted order),
+    union (|), difference (-) and intersection (&),
+    and a compact on-disk form (save() and load()).
+    """
+
+    def __init__(self, ids=()):
+        """
+        Create a set from the given iterable of CELLAR id str.
+
+        :param ids: iterable of str
+        """
+        packed_ids = bytearray()
+        other_ids = set()
+        for cellar_id in ids:
+            packed = pack_cellar_id(cellar_id)
+            if packed is None:
+                other_ids.add(cellar_id)
+            else:
+                packed_ids += packed
+
+        self.uuids = np.unique(np.frombuffer(bytes(packed_ids), dtype='S16'))
+        self.others = frozenset(other_ids)
+
+    @classmethod
+    def from_arrays(cls, uuids, others):
+        """
+        Create a set from a sorted array of unique 16-byte values
+        and a set of other ids.
+
+        :param uuids: numpy array of S16
+        :param others: set of str
+        :return: CellarIdSet
+        """
+        id_set = cls()
+        id_set.uuids = uuids
+        id_set.others = frozenset(others)
+        return id_set
+
+    def __len__(self):
+        return len(self.uuids) + len(self.others)
+
+    def __contains__(self, cellar_id):
+        packed = pack_cellar_id(cellar_id)
+        if packed is None:
+            return cellar_id in self.others
+
+        index = np.searchsorted(self.uuids, packed)
+        return index < len(self.uuids) and self.uuids[index] == packed.rstrip(b'\0')
+
+    def __iter__(self):
+        for packed in self.uuids:
+            yield unpack_cellar_id(packed)
+        for cellar_id in sorted(self.others):
+            yield cellar_id
+
+    def __eq__(self, other):
+        return np.array_equal(self.uuids, other.uuids) and self.others == other.others
+
+    def union(self, other):
+        return CellarIdSet.from_arrays(np.union1d(self.uuids, other.uuids), self.others | other.others)
+
+    def difference(self, other):
+        return CellarIdSet.from_arrays(np.setdiff1d(self.uuids, other.uuids, assume_unique=True),
+                                       self.others - other.others)
+
+    def intersection(self, other):
+        return CellarIdSet.from_arrays(np.intersect1d(self.uuids, other.uuids, assume_unique=True),
+                                       self.others & other.others)
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    def to_list(self):
+        """
+        Get the sorted list of CELLAR id str.
+
+        :return: list of str
+        """
+        if self.others:
+            return sorted(self)
+        return list(self)
+
+    def save(self, file_path):
+        """
+        Write the set to the given file_path in a compact binary form:
+        a header line, the number of UUIDs, the packed UUIDs,
+        and the other ids separated by newlines.
+
+        :param file_path: str
+        :return: None
+        """
+        with open(file_path, 'wb') as f:
+            f.write(ID_SET_MAGIC)
+            f.write(len(self.uuids).to_bytes(8, 'little'))
+            f.write(self.uuids.tobytes())
+            f.write('\n'.join(sorted(self.others)).encode('utf-8'))
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Read a set written by save() from the given file_path.
+
+        :param file_path: str
+        :return: CellarIdSet
+        """
+        with open(file_path, 'rb') as f:
+            if f.read(len(ID_SET_MAGIC)) != ID_SET_MAGIC:
+                raise ValueError('Not a CELLAR id set file: ' + file_path)
+            count = int.from_bytes(f.read(8), 'little')
+            uuids = np.frombuffer(f.read(16 * count), dtype='S16')
+            others = f.read().decode('utf-8')
+
+        return cls.from_arrays(uuids, others.split('\n') if others else [])
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Buffered writers for the output files and logs of a run.
+
+- write_file_atomic() writes a file with a single write call
+  to a temporary file that is then renamed, so that an interrupted run
+  never leaves a truncated file behind.
+- BatchedFileWriter buffers the text files to write
+  (e.g., the text files of get_text()) and writes them in batches,
+  creating each output directory only once.
+- LogWriter is a log file shared by all the threads of a run
+  (e.g., the failed downloads of process_range()), opened once
+  and written in batches of lines.
+"""
+
+import os
+from threading import Lock
+
+
+def write_file_atomic(file_path, text, encoding='utf-8'):
+    """
+    Write the given text to the given file_path with a single write call
+    to a temporary file in the same directory, then rename the temporary file.
+
+    :param file_path: str
+    :param text: str
+    :param encoding: str
+    :return: None
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding=encoding) as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+
+class BatchedFileWriter:
+    """
+    Buffer text files and write them atomically in batches
+    of max_files files or max_bytes characters.
+    The output directories are created once per writer.
+
+    Usage:
+    with BatchedFileWriter() as writer:
+        writer.write(file_path, text)
+    """
+
+    def __init__(self, max_files=256, max_bytes=16 * 1024 * 1024, encoding='utf-8'):
+        """
+        :param max_files: int
+        :param max_bytes: int
+        :param encoding: str
+        """
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.encoding = encoding
+        self.buffer = []
+        self.buffer_size = 0
+        self.created_dirs = set()
+
+    def write(self, file_path, text):
+        """
+        Add the given text file to the buffer and write the buffer if it is full.
+
+        :param file_path: str
+        :param text: str
+        :return: None
+        """
+        self.buffer.append((file_path, text))
+        self.buffer_size += len(text)
+
+        if len(self.buffer) >= self.max_files or self.buffer_size >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered text files.
+
+        :return: None
+        """
+        for file_path, text in self.buffer:
+            # Create each output directory only once
+            dir_path = os.path.dirname(file_path)
+            if dir_path not in self.created_dirs:
+                os.makedirs(dir_path or '.', exist_ok=True)
+                self.created_dirs.add(dir_path)
+
+            write_file_atomic(file_path, text, self.encoding)
+
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self):
+        """
+        Write the remaining buffered text files.
+
+        :return: None
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LogWriter:
+    """
+    Log file shared by the threads of a run.
+    The file is opened once (in append mode) and the lines
+    are written in batches of max_lines lines.
+
+    Usage:
+    failed_log = LogWriter('id_logs/failed_<date>-<time>.txt', header='Failed downloads <date>-<time>')
+    failed_log.write_line(cellar_id)  # from any thread
+    failed_log.close()
+    """
+
+    def __init__(self, file_path, header=None, max_lines=1000, encoding='utf-8'):
+        """
+        :param file_path: str
+        :param header: str
+        :param max_lines: int
+        :param encoding: str
+        """
+        self.file_path = file_path
+        self.max_lines = max_lines
+        self.lock = Lock()
+        self.lines = []
+
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        self.file = open(file_path, 'a', encoding=encoding)
+
+        if header is not None:
+            self.lines.append(header + '\n')
+
+    def write_line(self, line):
+        """
+        Add the given line to the log, writing the buffered lines if there are max_lines of them.
+
+        :param line: str
+        :return: None
+        """
+        with self.lock:
+            self.lines.append(str(line) + '\n')
+            if len(self.lines) >= self.max_lines:
+                self._write_lines()
+
+    def _write_lines(self):
+        self.file.write(''.join(self.lines))
+        self.file.flush()
+        self.lines = []
+
+    def flush(self):
+        """
+        Write the buffered lines.
+
+        :return: None
+        """
+        with self.lock:
+            if len(self.lines) != 0:
+                self._write_lines()
+
+    def close(self):
+        """
+        Write the buffered lines and close the log file.
+
+        :return: None
+        """
+        self.flush()
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# coding=<utf-8>
+
+"""
+Functions to extract the text of documents in an isolated worker process
+under per-document time and memory limits, and to keep a quarantine list
+of the documents that could not be processed.
+
+The quarantine file has one JSON record per line:
+{"source_file": ..., "reason": ..., "date": ...}
+"""
+
+import json
+import multiprocessing
+import os
+import zipfile
+from datetime import datetime
+from utils.doc2txt import doc2txt_bytes_eu, doc2txt_path_eu
+
+try:
+    import resource
+except ImportError:
+    # Memory limits are not available on this platform (e.g., Windows)
+    resource = None
+
+# Start the worker processes from a fork server (or a new interpreter where it is not available)
+# instead of forking the calling process, which may run other threads
+# (e.g., the HTTP server of harvest_daemon.py) whose locks would be copied in their current state
+worker_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                             else 'spawn')
+
+
+class ExtractionError(Exception):
+    """The text of a document could not be extracted by the worker."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """The extraction of a document took longer than the time limit."""
+
+
+def extraction_worker(connection, memory_limit):
+    """
+    Extract the text of the documents received through the given connection
+    and send back ('ok', text) or ('error', reason) for each one.
+    The address space of the worker process is limited to memory_limit bytes, if any.
+    A task is a (file_path, member, extension) tuple
+    where member is the name of a zip archive member or None.
+
+    :param connection: multiprocessing Connection
+    :param memory_limit: int
+    :return: None
+    """
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    # Keep the zip archive being read open for its next members
+    archive = None
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        file_path, member, extension = task
+        try:
+            if member is not None:
+                if archive is None or archive.filename != file_path:
+                    if archive is not None:
+                        archive.close()
+                    archive = zipfile.ZipFile(file_path)
+                text = doc2txt_bytes_eu(archive.read(member), extension)
+            else:
+                text = doc2txt_path_eu(file_path)
+            connection.send(('ok', text))
+        except MemoryError:
+            connection.send(('error', 'memory limit exceeded'))
+        except Exception as e:
+            connection.send(('error', type(e).__name__ + ': ' + str(e)))
+
+
+class ExtractionWorker:
+    """
+    Worker process that extracts the text of one document at a time
+    under the given time limit (in seconds) and memory limit (in bytes).
+    A worker that exceeds the time limit or dies is replaced by a new one.
+    """
+
+    def __init__(self, timeout=60, memory_limit=None):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        self.connection, worker_connection = worker_context.Pipe()
+        self.process = worker_context.Process(target=extraction_worker,
+                                              args=(worker_connection, self.memory_limit), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+            self.process = None
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+            self.stop()
+
+    def extract(self, file_path, member=None, extension=None):
+        """
+        Get the text of the given file (or of the given member of the zip archive file_path).
+        Raise ExtractionTimeout if the time limit is exceeded
+        and ExtractionError if the extraction failed or the worker died.
+
+        :param file_path: str
+        :param member: str
+        :param extension: str
+        :return: str
+        """
+        if self.process is None:
+            self.start()
+
+        self.connection.send((file_path, member, extension))
+
+        if not self.connection.poll(self.timeout):
+            self.stop()
+            raise ExtractionTimeout('time limit exceeded (' + str(self.timeout) + ' s)')
+
+        try:
+            status, result = self.connection.recv()
+        except EOFError:
+            # The worker died (e.g., killed for using too much memory)
+            self.stop()
+            raise ExtractionError('worker process died')
+
+        if status == 'error':
+            raise ExtractionError(result)
+
+        return result
+
+
+def load_quarantine(quarantine_path):
+    """
+    Get the quarantined files from the given quarantine_path.
+    Return a dictionary where key=source file, value=reason.
+
+    :param quarantine_path: file path str
+    :return: dict of { str : str }
+    """
+    quarantine = {}
+    if quarantine_path is not None and os.path.exists(quarantine_path):
+        with open(quarantine_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    quarantine[record['source_file']] = record['reason']
+    return quarantine
+
+
+def quarantine_file(quarantine_path, source_file, reason):
+    """
+    Add the given source_file to the quarantine list in the given quarantine_path
+    with the reason why it could not be processed.
+
+    :param quarantine_path: file path str
+    :param source_file: str
+    :param reason: str
+    :return: None
+    """
+    if os.path.dirname(quarantine_path):
+        os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+
+    record = {'source_file': source_file, 'reason': reason, 'date': str(datetime.now())}
+    with open(quarantine_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
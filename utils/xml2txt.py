@@ -7,7 +7,7 @@
 import re
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup, NavigableString, Tag
-from utils.html2txt import html2txt_path_eu
+from utils.html2txt import html2txt_str_eu
 
 
 def xml2txt_etree(file_path):
@@ -48,44 +48,69 @@ def xml2txt_bs4(file_path: str):
 
 
 def xml2txt_bs4_eu(file_path: str):
-    # Get XML root from file and text from XML
+    # Get XML string from file and text from XML
     with open(file_path, 'r', encoding='utf-8') as file:
-        xml_str = BeautifulSoup(file.read(), "lxml-xml")
-        # print('XML_STR:', xml_str.prettify())
-        # print('XML_NEXT_SIBLING:', xml_str.contents[0].next_sibling)
-        # print('XML_CONTENTS:', xml_str.contents[0].name)
-        # print('XML_CHILDREN:', len(list(xml_str.contents[0].children)), list(xml_str.contents[0].children))
-        # print('XML_TAGS:', [tag.name for tag in xml_str.find_all()])
-        # print('XML_NESTED:', len(xml_str.ACT.findChildren(recursive=False)))
-
-        # If XML file with Doctype declaration, process with html2txt
-        if 'html' in xml_str.contents[0]:
-            return html2txt_path_eu(file_path)
-        # Else, process XML
-        else:
-            # Remove footnotes
-            footnotes = xml_str.find_all(TYPE="FOOTNOTE")
-            for note in footnotes:
-                # print('NOTE:', note)
-                note.clear()
-
-            # Get text
-            raw_str_list = []
-            for child in xml_str.contents[0].children:
-                if isinstance(child, NavigableString):
-                    # print('NavigableString:', child.name)
-                    continue
-                if isinstance(child, Tag):
-                    # print('CHILD:', child.name)
-                    raw_str_list.append(child.get_text(" ", strip=True))
-
-        raw_str = '\n\n'.join(raw_str_list)
-        # print('RAW_STR:', raw_str)
+        return xml2txt_str_eu(file.read())
 
-        # Clean-up text
-        clean_str = clean_up_str(raw_str)
 
-        return clean_str
+def xml2txt_str_eu(xml_string: str):
+    """
+    Get text string from the given string of an EU XML (Formex) document.
+    Footnotes are removed and the text of each top-level element
+    is separated by an empty line.
+
+    :param xml_string: str
+    :return: str
+    """
+    # Get XML root from string
+    xml_str = BeautifulSoup(xml_string, "lxml-xml")
+    # print('XML_STR:', xml_str.prettify())
+    # print('XML_NEXT_SIBLING:', xml_str.contents[0].next_sibling)
+    # print('XML_CONTENTS:', xml_str.contents[0].name)
+    # print('XML_CHILDREN:', len(list(xml_str.contents[0].children)), list(xml_str.contents[0].children))
+    # print('XML_TAGS:', [tag.name for tag in xml_str.find_all()])
+    # print('XML_NESTED:', len(xml_str.ACT.findChildren(recursive=False)))
+
+    # If XML file with Doctype declaration, process with html2txt
+    if 'html' in xml_str.contents[0]:
+        return html2txt_str_eu(xml_string)
+    # Else, process XML
+    else:
+        return xml2txt_soup_eu(xml_str)
+
+
+def xml2txt_soup_eu(xml_str):
+    """
+    Get text string from the given parsed EU XML (Formex) document (BeautifulSoup).
+    Footnotes are removed and the text of each top-level element
+    is separated by an empty line.
+
+    :param xml_str: BeautifulSoup
+    :return: str
+    """
+    # Remove footnotes
+    footnotes = xml_str.find_all(TYPE="FOOTNOTE")
+    for note in footnotes:
+        # print('NOTE:', note)
+        note.clear()
+
+    # Get text
+    raw_str_list = []
+    for child in xml_str.contents[0].children:
+        if isinstance(child, NavigableString):
+            # print('NavigableString:', child.name)
+            continue
+        if isinstance(child, Tag):
+            # print('CHILD:', child.name)
+            raw_str_list.append(child.get_text(" ", strip=True))
+
+    raw_str = '\n\n'.join(raw_str_list)
+    # print('RAW_STR:', raw_str)
+
+    # Clean-up text
+    clean_str = clean_up_str(raw_str)
+
+    return clean_str
 
 
 def clean_up_str(raw_str):